@@ -0,0 +1,223 @@
+"""Revenue, margin, top sellers, slow movers and supplier contribution (/analytics).
+
+Reports never scan invoice lines: they read sales_daily, one row per (day,
+product) with quantity, revenue and cost, so a year of history is at most
+365 x (products sold per day) rows. Invoice writers mark the day of every
+invoice they touch in sales_dirty_days (repository.py SALES ROLLUPS) and
+refresh() re-aggregates just those days, so edits and deletions of old
+invoices are picked up as well as new sales.
+
+Rows arrive as batches of tuples (db.fetch_batches), are turned into NumPy
+columns once per batch and reduced with np.unique / np.bincount instead of
+per-row Python. Invoice lines don't record the cost price, so a day's cost
+is the products' cost_price when that day was last rolled up; supplier
+contribution uses each product's current supplier.
+"""
+import os
+from datetime import date, timedelta
+
+ANALYTICS_BATCH_ROWS = int(os.getenv("ANALYTICS_BATCH_ROWS", "20000"))
+# Dirty days re-aggregated per transaction
+ANALYTICS_ROLLUP_DAYS = int(os.getenv("ANALYTICS_ROLLUP_DAYS", "31"))
+# Dirty days a dashboard view rolls up itself before reading (the rest: flask rollup-sales)
+ANALYTICS_INLINE_DAYS = int(os.getenv("ANALYTICS_INLINE_DAYS", "7"))
+ANALYTICS_DEFAULT_DAYS = int(os.getenv("ANALYTICS_DEFAULT_DAYS", "30"))
+ANALYTICS_TOP = int(os.getenv("ANALYTICS_TOP", "10"))
+
+GRANULARITIES = ("day", "week", "month")
+TOP_SORTS = ("revenue", "quantity", "margin")
+
+
+def _columns(batches, dtypes):
+    """Concatenate batches of row tuples into one NumPy array per column."""
+    import numpy as np  # optional dependency, only needed for analytics
+
+    parts = [[] for _ in dtypes]
+    for rows in batches:
+        for part, values, dtype in zip(parts, zip(*rows), dtypes):
+            part.append(np.array(values, dtype=dtype))
+    return [np.concatenate(p) if p else np.empty(0, dtype=dtype) for p, dtype in zip(parts, dtypes)]
+
+
+def _sum_by(keys, *values):
+    """(sorted distinct keys, [sum of each value column per key])."""
+    import numpy as np
+
+    uniq, inverse = np.unique(keys, return_inverse=True)
+    return uniq, [np.bincount(inverse, weights=v, minlength=len(uniq)) for v in values]
+
+
+# -------------------- ROLLUPS --------------------
+
+def _runs(days):
+    """Sorted days -> [(first, last)] of consecutive stretches (one range scan each)."""
+    runs = []
+    for day in days:
+        if runs and day == runs[-1][1] + timedelta(days=1):
+            runs[-1][1] = day
+        else:
+            runs.append([day, day])
+    return runs
+
+
+def rollup_days(db, days):
+    """sales_daily rows [(day, product id, quantity, revenue, cost)] for `days`, from their invoice lines."""
+    import numpy as np
+
+    keys, sums = [], []
+    for first, last in _runs(days):
+        for rows in db.sales_lines(first, last + timedelta(days=1), ANALYTICS_BATCH_ROWS):
+            day, product_id, qty, subtotal, unit_cost = _columns(
+                [rows], ["datetime64[D]", np.int64, np.float64, np.float64, np.float64])
+            # (day, product) packed into one int64: days since 1970 in the high half
+            k, s = _sum_by(day.astype(np.int64) << 32 | product_id, qty, subtotal, qty * unit_cost)
+            keys.append(k)
+            sums.append(s)
+    if not keys:
+        return []
+    # Combine the per-batch partial sums
+    k, (qty, revenue, cost) = _sum_by(np.concatenate(keys), *(np.concatenate(c) for c in zip(*sums)))
+    day = (k >> 32).astype("datetime64[D]")
+    return list(zip(day.tolist(), (k & 0xFFFFFFFF).tolist(), np.rint(qty).astype(np.int64).tolist(),
+                    np.round(revenue, 2).tolist(), np.round(cost, 2).tolist()))
+
+
+def refresh(repo, max_days=None, on_commit=None):
+    """Re-aggregate dirty days, ANALYTICS_ROLLUP_DAYS per transaction; returns (days, rollup rows).
+
+    max_days bounds the work (None: until no day is dirty). on_commit(version)
+    gets the "sales" data version after each committed transaction.
+    """
+    n_days = n_rows = 0
+    while max_days is None or n_days < max_days:
+        limit = ANALYTICS_ROLLUP_DAYS if max_days is None else min(ANALYTICS_ROLLUP_DAYS, max_days - n_days)
+        with repo.session() as db:
+            days = db.take_dirty_sales_days(limit)
+            if not days:
+                break
+            rows = rollup_days(db, days)
+            version = db.replace_sales_rollups(days, rows)
+            db.commit()
+        if on_commit:
+            on_commit(version)
+        n_days += len(days)
+        n_rows += len(rows)
+    return n_days, n_rows
+
+
+# -------------------- REPORT --------------------
+
+def parse_period(start, end, granularity, today=None):
+    """Validate query args; defaults to the last ANALYTICS_DEFAULT_DAYS days, per day.
+
+    Raises ValueError with a readable message.
+    """
+    today = today or date.today()
+    try:
+        end = date.fromisoformat(end) if end else today
+        start = date.fromisoformat(start) if start else end - timedelta(days=ANALYTICS_DEFAULT_DAYS - 1)
+    except ValueError:
+        raise ValueError("start/end must be dates in YYYY-MM-DD format.")
+    if start > end:
+        raise ValueError("start must not be after end.")
+    granularity = granularity or "day"
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"granularity must be one of: {', '.join(GRANULARITIES)}.")
+    return start, end, granularity
+
+
+def _bucket(days, granularity):
+    """First day of the day / week (Monday) / month each date falls in."""
+    import numpy as np
+
+    if granularity == "month":
+        return days.astype("datetime64[M]").astype("datetime64[D]")
+    if granularity == "week":
+        # 1970-01-01 (day 0) was a Thursday
+        return days - ((days.astype(np.int64) + 3) % 7).astype("timedelta64[D]")
+    return days
+
+
+def _money(values):
+    return [round(v, 2) for v in values.tolist()]
+
+
+def report(repo, start, end, granularity="day", top=ANALYTICS_TOP, sort="revenue"):
+    """Everything the dashboard shows for start..end (inclusive), as plain JSON-ready values."""
+    import numpy as np
+
+    with repo.session() as db:
+        day, product_id, qty, revenue, cost = _columns(
+            db.sales_rollups(start, end, ANALYTICS_BATCH_ROWS),
+            ["datetime64[D]", np.int64, np.float64, np.float64, np.float64])
+        ids, codes, names, suppliers, stock, unit_cost = _columns(
+            db.catalog_rows(ANALYTICS_BATCH_ROWS), [np.int64, object, object, object, np.int64, np.float64])
+        pending = db.dirty_sales_days()
+    margin = revenue - cost
+
+    # Revenue / cost / quantity per period, empty periods included
+    periods = np.unique(_bucket(np.arange(np.datetime64(start), np.datetime64(end) + 1), granularity))
+    slot = np.searchsorted(periods, _bucket(day, granularity))
+    p_revenue, p_cost, p_qty = (np.bincount(slot, weights=v, minlength=len(periods)) for v in (revenue, cost, qty))
+    series = [
+        {"period": p, "revenue": r, "cost": c, "margin": round(r - c, 2), "quantity": int(q)}
+        for p, r, c, q in zip(periods.astype(str).tolist(), _money(p_revenue), _money(p_cost), p_qty.tolist())
+    ]
+
+    # Per product, aligned with the catalog (ids are sorted); rows of deleted products are dropped
+    pos = np.searchsorted(ids, product_id)
+    known = pos < len(ids)
+    known[known] = ids[pos[known]] == product_id[known]
+    pos = pos[known]
+    sold_qty, sold_revenue, sold_margin = (
+        np.bincount(pos, weights=v[known], minlength=len(ids)) for v in (qty, revenue, margin))
+
+    def product(i, **extra):
+        return {"id": int(ids[i]), "product_id": codes[i], "name": names[i], "supplier": suppliers[i],
+                "quantity": int(sold_qty[i]), "revenue": round(float(sold_revenue[i]), 2),
+                "margin": round(float(sold_margin[i]), 2), **extra}
+
+    key = {"revenue": sold_revenue, "quantity": sold_qty, "margin": sold_margin}[sort]
+    sold = np.flatnonzero(sold_qty > 0)
+    top_sellers = [product(i) for i in sold[np.argsort(-key[sold], kind="stable")][:top]]
+
+    # Slow movers: in stock, longest to sell through at the period's sales rate (unsold first)
+    rate = sold_qty / ((end - start).days + 1)
+    with np.errstate(divide="ignore"):
+        cover = np.where(rate > 0, stock / rate, np.inf)
+    in_stock = np.flatnonzero(stock > 0)
+    slow = in_stock[np.lexsort((-stock[in_stock], -cover[in_stock]))][:top]
+    slow_movers = [
+        product(i, stock=int(stock[i]), stock_value=round(float(stock[i] * unit_cost[i]), 2),
+                days_of_cover=None if np.isinf(cover[i]) else round(float(cover[i]), 1))
+        for i in slow
+    ]
+
+    # Supplier contribution (products without a supplier count as "-")
+    supplier_of = np.where(np.equal(suppliers, None), "-", suppliers).astype(str)
+    names_s, s_sums = _sum_by(supplier_of, sold_revenue, sold_margin, sold_qty)
+    s_revenue, s_margin, s_qty = s_sums
+    total_revenue = float(revenue.sum())
+    by_revenue = np.argsort(-s_revenue, kind="stable")
+    by_revenue = by_revenue[s_qty[by_revenue] > 0]
+    supplier_rows = [
+        {"supplier": names_s[i], "revenue": round(float(s_revenue[i]), 2), "margin": round(float(s_margin[i]), 2),
+         "quantity": int(s_qty[i]), "share": round(float(s_revenue[i]) / total_revenue, 4) if total_revenue else 0.0}
+        for i in by_revenue
+    ]
+
+    total_margin = total_revenue - float(cost.sum())
+    return {
+        "start": start.isoformat(), "end": end.isoformat(), "granularity": granularity, "sort": sort,
+        "totals": {
+            "revenue": round(total_revenue, 2), "cost": round(float(cost.sum()), 2),
+            "margin": round(total_margin, 2),
+            "margin_pct": round(100 * total_margin / total_revenue, 1) if total_revenue else None,
+            "quantity": int(qty.sum()), "products_sold": int(len(sold)),
+        },
+        "series": series,
+        "top_sellers": top_sellers,
+        "slow_movers": slow_movers,
+        "suppliers": supplier_rows,
+        "pending_days": pending,  # dirty days not rolled up yet
+    }
@@ -1,116 +1,188 @@
-# import os
-# import time
-# import csv
-# import statistics
-# from encryption_schemes import (
-#     aesgcm_encrypt, aesgcm_decrypt,
-#     chacha_encrypt, chacha_decrypt,
-# )
-
-# import platform
-# import os
-
-# print("Platform:", platform.platform())
-# print("Processor:", platform.processor())
-# print("Python version:", platform.python_version())
-
-# def run_once(name, enc, dec, key, payload: bytes, n_ops: int) -> dict:
-#     t0 = time.perf_counter()
-#     for _ in range(n_ops):
-#         nonce, ct = enc(key, payload)
-#         _ = dec(key, nonce, ct)
-#     t1 = time.perf_counter()
-
-#     wall = t1 - t0
-#     return {
-#         "scheme": name,
-#         "payload_bytes": len(payload),
-#         "n_ops": n_ops,
-#         "wall_s": wall,
-#         "avg_ms_per_op": (wall / n_ops) * 1000.0,
-#         "ops_per_s": n_ops / wall,
-#     }
-
-# def benchmark(payload_sizes, n_ops=3000, repeats=5):
-#     aes_key = os.urandom(32)
-#     chacha_key = os.urandom(32)
-
-#     rows = []
-#     for size in payload_sizes:
-#         payload = b"a" * size
-#         for _ in range(repeats):
-#             rows.append(run_once("AES-GCM", aesgcm_encrypt, aesgcm_decrypt, aes_key, payload, n_ops))
-#             rows.append(run_once("ChaCha20-Poly1305", chacha_encrypt, chacha_decrypt, chacha_key, payload, n_ops))
-#     return rows
-
-# def summarize(rows):
-#     summary = []
-#     schemes = sorted(set(r["scheme"] for r in rows))
-#     sizes = sorted(set(r["payload_bytes"] for r in rows))
-
-#     for s in schemes:
-#         for size in sizes:
-#             subset = [r for r in rows if r["scheme"] == s and r["payload_bytes"] == size]
-#             avg_ms = statistics.mean(r["avg_ms_per_op"] for r in subset)
-#             std_ms = statistics.pstdev(r["avg_ms_per_op"] for r in subset)
-#             avg_ops = statistics.mean(r["ops_per_s"] for r in subset)
-#             std_ops = statistics.pstdev(r["ops_per_s"] for r in subset)
-#             summary.append({
-#                 "scheme": s,
-#                 "payload_bytes": size,
-#                 "avg_ms_per_op_mean": avg_ms,
-#                 "avg_ms_per_op_std": std_ms,
-#                 "ops_per_s_mean": avg_ops,
-#                 "ops_per_s_std": std_ops,
-#                 "repeats": len(subset),
-#             })
-#     return summary
-
-# def write_csv(path, rows):
-#     with open(path, "w", newline="", encoding="utf-8") as f:
-#         w = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
-#         w.writeheader()
-#         w.writerows(rows)
-
-# if __name__ == "__main__":
-#     payload_sizes = [64, 256, 1024, 4096, 16384]
-#     rows = benchmark(payload_sizes, n_ops=3000, repeats=5)
-#     summary = summarize(rows)
-
-#     write_csv("benchmark_raw.csv", rows)
-#     write_csv("benchmark_summary.csv", summary)
-
-#     print("Wrote benchmark_raw.csv and benchmark_summary.csv")
-#     for r in summary:
-#         print(r)
-
-import os, time, platform, csv
+"""AES-GCM vs ChaCha20-Poly1305 benchmark.
+
+    python benchmark_encryption.py                    # run, write bench_<env>.csv
+    python benchmark_encryption.py compare A.csv B.csv [--threshold 0.10]
+
+A run does WARMUP_OPS untimed operations, then REPEATS timed repeats of N_OPS
+encrypts followed by N_OPS decrypts, for every scheme x mode x payload size.
+Latency samples are taken per chunk of BATCH_SIZE operations (so the timer
+itself doesn't dominate) and summarised as mean (avg_ms, as in older CSVs),
+median, p95 and stddev. A second sweep measures scaling over 1..ncpu workers
+with a thread pool and a process pool and writes bench_<env>_scaling.csv.
+"""
+import argparse, csv, os, platform, statistics, sys, time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
-from encryption_schemes import aesgcm_encrypt, aesgcm_decrypt, chacha_encrypt, chacha_decrypt
+
+import psutil
+
+from encryption_schemes import aesgcm_encrypt, aesgcm_decrypt, chacha_encrypt, chacha_decrypt, AEADCipher
 
 PAYLOAD_SIZES = [64, 256, 1024, 4096, 16384]
 N_OPS = int(os.getenv("N_OPS", "10000"))
+WARMUP_OPS = int(os.getenv("WARMUP_OPS", "1000"))
+REPEATS = int(os.getenv("REPEATS", "5"))
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", "100"))
+MODES = os.getenv("BENCH_MODES", "per-call,cached,batch").split(",")
+SCALING_SIZE = int(os.getenv("SCALING_SIZE", "1024"))
+SCALING = os.getenv("BENCH_SCALING", "1") == "1"
 
 ENV_LABEL = os.getenv("BENCH_ENV", "local")  # set to "render" in Render worker
 OUT_CSV = os.getenv("BENCH_OUT", f"bench_{ENV_LABEL}.csv")
+SCALING_CSV = os.getenv("BENCH_SCALING_OUT", f"bench_{ENV_LABEL}_scaling.csv")
+
+SCHEMES = [
+    ("AES-GCM", "aesgcm", aesgcm_encrypt, aesgcm_decrypt),
+    ("ChaCha20-Poly1305", "chacha", chacha_encrypt, chacha_decrypt),
+]
+SCHEME_BY_ALGORITHM = {algorithm: (enc, dec) for _, algorithm, enc, dec in SCHEMES}
+
+# -------------------- MODES --------------------
+
+def make_ops(mode, algorithm, key):
+    """(encrypt(plaintexts) -> items, decrypt(items)) for one benchmark mode."""
+    if mode == "per-call":
+        # New AESGCM/ChaCha20Poly1305 object on every encrypt and decrypt
+        enc_fn, dec_fn = SCHEME_BY_ALGORITHM[algorithm]
+        return (lambda pts: [enc_fn(key, pt) for pt in pts],
+                lambda items: [dec_fn(key, n, ct) for n, ct in items])
+    cipher = AEADCipher(key, algorithm)
+    if mode == "cached":
+        # One keyed primitive, one call per message
+        return (lambda pts: [cipher.encrypt(pt) for pt in pts],
+                lambda items: [cipher.decrypt(n, ct) for n, ct in items])
+    if mode == "batch":
+        # One keyed primitive, BATCH_SIZE messages per call
+        return cipher.encrypt_many, cipher.decrypt_many
+    raise ValueError(f"Unknown mode: {mode}")
+
+# -------------------- STATS --------------------
+
+def p95(samples):
+    if len(samples) < 2:
+        return samples[0]
+    return statistics.quantiles(samples, n=20, method="inclusive")[18]
+
+def summarize(samples_ms):
+    return {
+        "avg_ms": statistics.mean(samples_ms),
+        "median_ms": statistics.median(samples_ms),
+        "p95_ms": p95(samples_ms),
+        "std_ms": statistics.pstdev(samples_ms),
+    }
+
+class ResourceMeter:
+    """CPU% (of one core) and peak RSS of this process over a measured block."""
+
+    def __init__(self):
+        self.proc = psutil.Process()
+
+    def __enter__(self):
+        self._cpu = self.proc.cpu_times()
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self._t0
+        cpu = self.proc.cpu_times()
+        used = (cpu.user - self._cpu.user) + (cpu.system - self._cpu.system)
+        self.cpu_pct = used / wall * 100.0 if wall else 0.0
+        self.rss_mb = self.proc.memory_info().rss / 1024 / 1024
+        return False
+
+# -------------------- SINGLE-THREAD RUN --------------------
+
+def run_scheme(mode, algorithm, key, payload_size, n_ops, repeats=REPEATS, warmup=WARMUP_OPS):
+    """Return {"enc": ..., "dec": ..., "both": ...} summary dicts for one combination."""
+    enc, dec = make_ops(mode, algorithm, key)
+    chunk = [os.urandom(payload_size)] * BATCH_SIZE
+
+    for _ in range(max(1, warmup // BATCH_SIZE)):
+        dec(enc(chunk))
+
+    enc_samples, dec_samples = [], []
+    enc_totals, dec_totals = [], []
+    with ResourceMeter() as meter:
+        for _ in range(repeats):
+            enc_total = dec_total = 0.0
+            done = 0
+            while done < n_ops:
+                pts = chunk[:min(BATCH_SIZE, n_ops - done)]
+                t0 = time.perf_counter()
+                items = enc(pts)
+                t1 = time.perf_counter()
+                dec(items)
+                t2 = time.perf_counter()
+                enc_samples.append((t1 - t0) * 1000.0 / len(pts))
+                dec_samples.append((t2 - t1) * 1000.0 / len(pts))
+                enc_total += t1 - t0
+                dec_total += t2 - t1
+                done += len(pts)
+            enc_totals.append(enc_total)
+            dec_totals.append(dec_total)
 
-def run_scheme(name, enc_fn, dec_fn, key, payload_size, n_ops):
-    plaintext = os.urandom(payload_size)
+    both_samples = [e + d for e, d in zip(enc_samples, dec_samples)]
+    both_totals = [e + d for e, d in zip(enc_totals, dec_totals)]
+    out = {}
+    for phase, samples, totals in (("enc", enc_samples, enc_totals),
+                                   ("dec", dec_samples, dec_totals),
+                                   ("both", both_samples, both_totals)):
+        total = statistics.median(totals)
+        ops_s = n_ops / total
+        out[phase] = {"total_s": total, **summarize(samples), "ops_per_s": ops_s,
+                      "bytes_per_s": payload_size * ops_s,
+                      "cpu_pct": meter.cpu_pct, "rss_mb": meter.rss_mb}
+    return out
+
+# -------------------- SCALING SWEEP --------------------
+
+def scaling_worker(algorithm, key, payload_size, n_ops):
+    """Cached-cipher enc+dec loop; returns (wall_s, cpu_s, rss_bytes) of the worker."""
+    cipher = AEADCipher(key, algorithm)
+    payload = os.urandom(payload_size)
+    cpu0 = time.thread_time()
     t0 = time.perf_counter()
     for _ in range(n_ops):
-        nonce, ct = enc_fn(key, plaintext)
-        _ = dec_fn(key, nonce, ct)
-    t1 = time.perf_counter()
-    total = t1 - t0
-    avg_ms = (total / n_ops) * 1000.0
-    ops_s = n_ops / total
-    bytes_s = payload_size * ops_s
-    return total, avg_ms, ops_s, bytes_s
+        nonce, ct = cipher.encrypt(payload)
+        cipher.decrypt(nonce, ct)
+    return time.perf_counter() - t0, time.thread_time() - cpu0, psutil.Process().memory_info().rss
+
+def worker_counts(ncpu):
+    counts, n = [], 1
+    while n < ncpu:
+        counts.append(n)
+        n *= 2
+    return counts + [ncpu]
+
+def run_scaling(algorithm, key, payload_size, n_ops, pool_kind, workers):
+    per_worker = max(1, n_ops // workers)
+    pool_cls = ThreadPoolExecutor if pool_kind == "thread" else ProcessPoolExecutor
+    with pool_cls(max_workers=workers) as pool:
+        # Start every worker (process spawn, imports) before timing
+        list(pool.map(scaling_worker, *zip(*[(algorithm, key, payload_size, 10)] * workers)))
+        t0 = time.perf_counter()
+        results = list(pool.map(scaling_worker, *zip(*[(algorithm, key, payload_size, per_worker)] * workers)))
+        wall = time.perf_counter() - t0
+    cpu_s = sum(r[1] for r in results)
+    if pool_kind == "thread":
+        rss = results[0][2]
+    else:
+        rss = psutil.Process().memory_info().rss + sum(r[2] for r in results)
+    ops = per_worker * workers
+    return {"total_s": wall, "ops_per_s": ops / wall, "bytes_per_s": payload_size * ops / wall,
+            "cpu_pct": cpu_s / wall * 100.0, "rss_mb": rss / 1024 / 1024}
+
+# -------------------- OUTPUT --------------------
+
+def write_csv(path, rows):
+    with open(path, "w", newline="") as f:
+        w = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+        w.writeheader()
+        w.writerows(rows)
 
 def main():
-    import os as _os
-    aes_key = _os.urandom(32)
-    chacha_key = _os.urandom(32)
+    keys = {algorithm: os.urandom(32) for _, algorithm, _, _ in SCHEMES}
+    ncpu = os.cpu_count() or 1
 
     meta = {
         "timestamp": datetime.utcnow().isoformat(),
@@ -118,35 +190,102 @@ def main():
         "platform": platform.platform(),
         "python": platform.python_version(),
         "machine": platform.machine(),
+        "ncpu": ncpu,
     }
 
     rows = []
     for size in PAYLOAD_SIZES:
-        total, avg_ms, ops_s, bytes_s = run_scheme("AES-GCM", aesgcm_encrypt, aesgcm_decrypt, aes_key, size, N_OPS)
-        rows.append({**meta, "scheme":"AES-GCM", "payload_bytes":size, "n_ops":N_OPS,
-                     "total_s":total, "avg_ms":avg_ms, "ops_per_s":ops_s, "bytes_per_s":bytes_s})
-        total, avg_ms, ops_s, bytes_s = run_scheme("ChaCha20-Poly1305", chacha_encrypt, chacha_decrypt, chacha_key, size, N_OPS)
-        rows.append({**meta, "scheme":"ChaCha20-Poly1305", "payload_bytes":size, "n_ops":N_OPS,
-                     "total_s":total, "avg_ms":avg_ms, "ops_per_s":ops_s, "bytes_per_s":bytes_s})
-
-    fieldnames = list(rows[0].keys())
-    with open(OUT_CSV, "w", newline="") as f:
-        w = csv.DictWriter(f, fieldnames=fieldnames)
-        w.writeheader()
-        w.writerows(rows)
+        for name, algorithm, _, _ in SCHEMES:
+            for mode in MODES:
+                result = run_scheme(mode, algorithm, keys[algorithm], size, N_OPS)
+                for phase, r in result.items():
+                    rows.append({**meta, "scheme":name, "mode":mode, "phase":phase, "payload_bytes":size,
+                                 "workers":1, "n_ops":N_OPS, "repeats":REPEATS, **r})
+                r = result["both"]
+                print(ENV_LABEL, name, mode, size,
+                      f'enc={result["enc"]["median_ms"]:.6f}ms dec={result["dec"]["median_ms"]:.6f}ms (median)',
+                      f'p95={r["p95_ms"]:.6f}ms std={r["std_ms"]:.6f}ms ops/s={r["ops_per_s"]:.1f}')
+    write_csv(OUT_CSV, rows)
+
+    # Speed-up of cached/batch over the per-call baseline
+    base = {(r["scheme"], r["payload_bytes"]): r["ops_per_s"] for r in rows
+            if r["mode"] == "per-call" and r["phase"] == "both"}
+    if base:
+        print("\n=== SPEED-UP vs per-call ===")
+        for r in rows:
+            ref = base.get((r["scheme"], r["payload_bytes"]))
+            if r["mode"] != "per-call" and r["phase"] == "both" and ref:
+                print(r["scheme"], r["mode"], r["payload_bytes"], f'x{r["ops_per_s"] / ref:.2f}')
+
+    if SCALING:
+        print(f"\n=== SCALING ({SCALING_SIZE} B payload, 1..{ncpu} workers) ===")
+        scaling_rows = []
+        for name, algorithm, _, _ in SCHEMES:
+            for pool_kind in ("thread", "process"):
+                single = None
+                for workers in worker_counts(ncpu):
+                    r = run_scaling(algorithm, keys[algorithm], SCALING_SIZE, N_OPS, pool_kind, workers)
+                    single = single or r["ops_per_s"]
+                    r["speedup"] = r["ops_per_s"] / single
+                    r["efficiency"] = r["speedup"] / workers
+                    scaling_rows.append({**meta, "scheme":name, "mode":f"{pool_kind}-pool", "phase":"both",
+                                         "payload_bytes":SCALING_SIZE, "workers":workers, "n_ops":N_OPS, **r})
+                    print(name, pool_kind, workers, f'ops/s={r["ops_per_s"]:.1f}', f'x{r["speedup"]:.2f}',
+                          f'cpu={r["cpu_pct"]:.0f}%', f'rss={r["rss_mb"]:.1f}MB')
+        write_csv(SCALING_CSV, scaling_rows)
+        print("Wrote:", SCALING_CSV)
 
+    print("\n=== BENCHMARK COMPLETE ===")
     print("Wrote:", OUT_CSV)
     print("Env:", ENV_LABEL)
     print("Platform:", meta["platform"])
-    # Print final summary for easy copy from logs
-    for r in rows:
-        print(r["env"], r["scheme"], r["payload_bytes"], f'avg_ms={r["avg_ms"]:.6f}', f'ops/s={r["ops_per_s"]:.1f}', f'bytes/s={r["bytes_per_s"]:.1f}')
-        
-    print("\n=== BENCHMARK COMPLETE ===")
-    print("Wrote:", OUT_CSV)
 
-    # Now print the file (only after it exists)
-    with open(OUT_CSV, "r") as f:
-        print(f.read())
+# -------------------- COMPARE --------------------
+
+def _load(path):
+    """{(scheme, mode, phase, payload_bytes, workers): row}; older CSVs had per-call enc+dec only."""
+    with open(path, newline="") as f:
+        return {
+            (r["scheme"], r.get("mode") or "per-call", r.get("phase") or "both",
+             int(r["payload_bytes"]), int(r.get("workers") or 1)): r
+            for r in csv.DictReader(f)
+        }
+
+def compare(base_path, new_path, threshold=0.10):
+    """Print ops/s changes from base to new; returns the number of regressions."""
+    base, new = _load(base_path), _load(new_path)
+    common = sorted(base.keys() & new.keys())
+    if not common:
+        print("No comparable rows (scheme/mode/phase/payload/workers) in both files.")
+        return 0
+    regressions = 0
+    print(f"{'scheme':<18} {'mode':<14} {'phase':<5} {'bytes':>6} {'wk':>3} {'base ops/s':>12} {'new ops/s':>12} {'delta':>8}")
+    for key in common:
+        old_ops, new_ops = float(base[key]["ops_per_s"]), float(new[key]["ops_per_s"])
+        delta = (new_ops - old_ops) / old_ops
+        flag = ""
+        if delta < -threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        elif delta > threshold:
+            flag = "  faster"
+        print(f"{key[0]:<18} {key[1]:<14} {key[2]:<5} {key[3]:>6} {key[4]:>3} {old_ops:>12.1f} {new_ops:>12.1f} {delta:>+8.1%}{flag}")
+    only = len(base.keys() ^ new.keys())
+    if only:
+        print(f"({only} rows only in one file were skipped)")
+    print(f"\n{regressions} regression(s) beyond {threshold:.0%}")
+    return regressions
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="AEAD encryption benchmark")
+    sub = parser.add_subparsers(dest="command")
+    sub.add_parser("run", help="run the benchmark (default)")
+    cmp_parser = sub.add_parser("compare", help="diff two result CSVs and flag regressions")
+    cmp_parser.add_argument("base")
+    cmp_parser.add_argument("new")
+    cmp_parser.add_argument("--threshold", type=float, default=0.10,
+                            help="relative ops/s drop reported as a regression (default 0.10)")
+    args = parser.parse_args()
+    if args.command == "compare":
+        sys.exit(1 if compare(args.base, args.new, args.threshold) else 0)
+    main()
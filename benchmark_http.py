@@ -0,0 +1,334 @@
+"""HTTP load benchmark for the Flask app.
+
+    python benchmark_http.py seed --skus 100000 --invoices 5000   # synthetic data (DB_BACKEND database)
+    python benchmark_http.py run --url http://127.0.0.1:8000 --concurrency 1,8,32
+    python benchmark_http.py compare bench_http_local.csv bench_http_render.csv
+    python benchmark_http.py seed --reset                         # remove the synthetic data
+
+`run` drives the app over real HTTP (start it with gunicorn as in production)
+and only needs the seeded catalog: product ids come from the search endpoint
+and invoice ids from the invoices it creates itself. Results are written in
+the bench_*.csv style, one row per route and concurrency level.
+"""
+import argparse, csv, http.client, json, os, platform, random, statistics, sys, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import urlencode, urlsplit
+
+ENV_LABEL = os.getenv("BENCH_ENV", "local")
+OUT_CSV = os.getenv("BENCH_OUT", f"bench_http_{ENV_LABEL}.csv")
+SEED_PREFIX = "BENCH-"
+
+# route -> relative weight in the request mix
+ROUTES = {
+    "home": 3,
+    "search": 6,
+    "save_invoice": 1,
+    "invoices": 2,
+    "invoice_detail": 2,
+    "invoice_pdf": 1,
+}
+
+WORDS = ["mobil", "robot", "boneka", "balok", "puzzle", "kereta", "pesawat", "bola", "lego", "kapal",
+         "dinosaurus", "truk", "drone", "masak", "dokter", "rumah", "kuda", "tembak", "remote", "magnet"]
+SUPPLIERS = ["Sinar Jaya", "Toko Abadi", "Maju Bersama", "CV Ceria", "PT Mainan Nusantara", "Gudang Anak"]
+
+# -------------------- SEED --------------------
+
+def _catalog_rows(n, rng):
+    for i in range(1, n + 1):
+        name = f"{rng.choice(WORDS).title()} {rng.choice(WORDS)} {i}"
+        cost = rng.randint(5, 500) * 1000
+        yield (f"{SEED_PREFIX}{i:07d}", name, 1_000_000, rng.choice(SUPPLIERS), cost, int(cost * 1.3))
+
+def seed(skus, invoices, items_per_invoice, rng):
+    from field_crypto import encrypt_field
+    from repository import get_repository
+
+    with get_repository().session() as db:
+        t0 = time.perf_counter()
+        # COPY on Postgres (chunked, so 1M SKUs never sit in memory at once)
+        db.copy_rows("inventory", ("product_id", "name", "stock", "supplier", "cost_price", "selling_price"),
+                     _catalog_rows(skus, rng))
+        print(f"{skus} SKUs in {time.perf_counter() - t0:.1f}s")
+
+        t0 = time.perf_counter()
+        with db.cursor() as cur:
+            # Opening balances, so reconcile-stock sees a consistent ledger
+            cur.execute("""
+                INSERT INTO stock_movements (product_id, delta, reason)
+                SELECT id, stock, 'opening' FROM inventory WHERE product_id LIKE %s
+            """, (SEED_PREFIX + "%",))
+            cur.execute("SELECT id FROM inventory WHERE product_id LIKE %s", (SEED_PREFIX + "%",))
+            product_ids = [r["id"] for r in cur.fetchall()]
+        headers = db.insert_many("invoices", ("customer_name", "created_at"), [
+            (encrypt_field(f"{SEED_PREFIX}Pelanggan {i}", "invoices.customer_name"),
+             datetime.now().replace(microsecond=0) - rng.random() * (datetime.now() - datetime(2024, 1, 1)))
+            for i in range(invoices)], returning="id")
+        lines = []
+        for invoice_id in headers:
+            for product_id in rng.sample(product_ids, min(items_per_invoice, len(product_ids))):
+                qty, price = rng.randint(1, 5), rng.randint(5, 650) * 1000
+                lines.append((invoice_id, product_id, qty, price, qty * price))
+        db.insert_many("invoice_items", ("invoice_id", "product_id", "quantity", "price", "subtotal"),
+                       lines, page_size=5000)
+        with db.cursor() as cur:
+            cur.execute(f"""
+                UPDATE invoices SET
+                    total = (SELECT SUM(subtotal) FROM invoice_items ii WHERE ii.invoice_id = invoices.id),
+                    item_count = (SELECT COUNT(*) FROM invoice_items ii WHERE ii.invoice_id = invoices.id)
+                WHERE id {db.in_array('%s')}
+            """, (headers,))
+        db.mark_sales_dirty(headers)  # picked up by the next analytics refresh
+        db.bump_version("inventory")
+        db.bump_version("invoices")
+        db.commit()
+        print(f"{invoices} invoices / {len(lines)} lines in {time.perf_counter() - t0:.1f}s")
+
+def reset():
+    from repository import get_repository
+
+    with get_repository().session() as db:
+        db.begin()
+        with db.cursor() as cur:
+            cur.execute("""
+                SELECT DISTINCT ii.invoice_id FROM invoice_items ii
+                JOIN inventory inv ON inv.id = ii.product_id
+                WHERE inv.product_id LIKE %s
+            """, (SEED_PREFIX + "%",))
+            invoice_ids = [r["invoice_id"] for r in cur.fetchall()]
+            db.mark_sales_dirty(invoice_ids)
+            cur.execute(f"DELETE FROM invoices WHERE id {db.in_array('%s')}", (invoice_ids,))
+            n_inv = cur.rowcount
+            # Removing the products is a stock change like any other
+            cur.execute("""
+                INSERT INTO stock_movements (product_id, delta, reason)
+                SELECT id, -stock, 'delete' FROM inventory WHERE product_id LIKE %s AND stock <> 0
+            """, (SEED_PREFIX + "%",))
+            cur.execute("DELETE FROM inventory WHERE product_id LIKE %s", (SEED_PREFIX + "%",))
+            n_sku = cur.rowcount
+        db.bump_version("inventory")
+        db.bump_version("invoices")
+        db.commit()
+        print(f"Removed {n_sku} SKUs and {n_inv} invoices")
+
+# -------------------- LOAD --------------------
+
+class Client:
+    """One keep-alive HTTP connection per worker thread."""
+
+    def __init__(self, base_url, timeout=30):
+        parts = urlsplit(base_url)
+        cls = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        self._new = lambda: cls(parts.netloc, timeout=timeout)
+        self.prefix = parts.path.rstrip("/")
+        self.conn = self._new()
+
+    def request(self, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        if body is not None:
+            body = json.dumps(body).encode()
+            headers["Content-Type"] = "application/json"
+        try:
+            self.conn.request(method, self.prefix + path, body=body, headers=headers)
+            resp = self.conn.getresponse()
+            data = resp.read()
+        except (OSError, http.client.HTTPException):
+            self.conn.close()
+            self.conn = self._new()
+            raise
+        return resp.status, resp.getheaders(), data
+
+XHR = {"X-Requested-With": "XMLHttpRequest"}
+
+class Scenario:
+    """Builds the request for each route from ids discovered while running."""
+
+    def __init__(self, products, invoice_ids, rng):
+        self.products = products
+        self.invoice_ids = invoice_ids
+        self.rng = rng
+        self.lock = threading.Lock()
+
+    def search_term(self):
+        p = self.rng.choice(self.products)
+        word = self.rng.choice([p["name"].split()[0], p["product_id"]])
+        return word[:self.rng.choice([2, 3, 4, 6])]
+
+    def call(self, client, route):
+        rng = self.rng
+        if route == "home":
+            return client.request("GET", "/")
+        if route == "search":
+            return client.request("GET", "/invoice?" + urlencode({"q": self.search_term()}), headers=XHR)
+        if route == "invoices":
+            return client.request("GET", "/invoices")
+        if route == "save_invoice":
+            items = [{"id": p["id"], "qty": 1, "price": float(p["selling_price"] or 0)}
+                     for p in rng.sample(self.products, min(3, len(self.products)))]
+            status, headers, body = client.request("POST", "/save_invoice",
+                                                   body={"customer_name": "Bench Pelanggan", "items": items})
+            if status == 200:
+                with self.lock:
+                    self.invoice_ids.append(json.loads(body)["invoice_id"])
+            return status, headers, body
+        if not self.invoice_ids:
+            return self.call(client, "save_invoice")
+        invoice_id = rng.choice(self.invoice_ids)
+        if route == "invoice_detail":
+            return client.request("GET", f"/invoice/{invoice_id}")
+        if route == "invoice_pdf":
+            return client.request("GET", f"/invoice/{invoice_id}/pdf")
+        raise ValueError(f"Unknown route: {route}")
+
+def discover(client, rng, n_invoices=20):
+    status, _, body = client.request("GET", "/invoice?" + urlencode({"q": SEED_PREFIX, "per_page": 500}),
+                                     headers=XHR)
+    products = json.loads(body) if status == 200 else []
+    products = [p for p in products if (p.get("stock") or 0) > 100] or products
+    if not products:
+        raise SystemExit("No products found - run `python benchmark_http.py seed` first")
+    scenario = Scenario(products, [], rng)
+    for _ in range(n_invoices):
+        scenario.call(client, "save_invoice")
+    return scenario
+
+def percentile(samples, q):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(round(q / 100 * (len(samples) - 1))))]
+
+def run_level(base_url, scenario, routes, concurrency, duration, warmup):
+    weights = [ROUTES[r] for r in routes]
+    results = {r: [] for r in routes}
+    errors = {r: 0 for r in routes}
+    lock = threading.Lock()
+    start = time.perf_counter()
+    deadline = start + warmup + duration
+
+    def worker(seed):
+        client = Client(base_url)
+        rng = random.Random(seed)
+        local = []
+        while True:
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+            route = rng.choices(routes, weights)[0]
+            t0 = time.perf_counter()
+            try:
+                status = scenario.call(client, route)[0]
+            except (OSError, http.client.HTTPException):
+                status = 0
+            t1 = time.perf_counter()
+            if t0 - start >= warmup:
+                local.append((route, status, t1 - t0))
+        with lock:
+            for route, status, elapsed in local:
+                if 200 <= status < 400:
+                    results[route].append(elapsed * 1000.0)
+                else:
+                    errors[route] += 1
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    return results, errors
+
+def run(args):
+    rng = random.Random(args.seed)
+    routes = [r for r in args.routes.split(",") if r]
+    unknown = set(routes) - ROUTES.keys()
+    if unknown:
+        raise SystemExit(f"Unknown routes: {', '.join(sorted(unknown))}")
+    scenario = discover(Client(args.url), rng)
+
+    meta = {
+        "timestamp": datetime.utcnow().isoformat(),
+        "env": ENV_LABEL,
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "target": args.url,
+    }
+    rows = []
+    for concurrency in [int(c) for c in args.concurrency.split(",")]:
+        results, errors = run_level(args.url, scenario, routes, concurrency, args.duration, args.warmup)
+        for route in routes:
+            samples = results[route]
+            if not samples:
+                continue
+            rows.append({**meta, "route": route, "concurrency": concurrency, "n_requests": len(samples),
+                         "errors": errors[route], "total_s": args.duration,
+                         "avg_ms": statistics.mean(samples), "p50_ms": percentile(samples, 50),
+                         "p95_ms": percentile(samples, 95), "p99_ms": percentile(samples, 99),
+                         "max_ms": max(samples), "req_per_s": len(samples) / args.duration})
+            r = rows[-1]
+            print(ENV_LABEL, f"c={concurrency}", route, f'req/s={r["req_per_s"]:.1f}',
+                  f'p50={r["p50_ms"]:.1f}ms p95={r["p95_ms"]:.1f}ms p99={r["p99_ms"]:.1f}ms',
+                  f'errors={r["errors"]}')
+    if not rows:
+        raise SystemExit("No successful requests")
+    with open(args.out, "w", newline="") as f:
+        w = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+        w.writeheader()
+        w.writerows(rows)
+    print("\n=== BENCHMARK COMPLETE ===")
+    print("Wrote:", args.out)
+
+# -------------------- COMPARE --------------------
+
+def compare(base_path, new_path, threshold=0.10):
+    """Flag routes whose req/s dropped or p95 grew by more than `threshold`."""
+    def load(path):
+        with open(path, newline="") as f:
+            return {(r["route"], int(r["concurrency"])): r for r in csv.DictReader(f)}
+    base, new = load(base_path), load(new_path)
+    regressions = 0
+    print(f"{'route':<16} {'c':>4} {'base req/s':>11} {'new req/s':>11} {'delta':>8} {'base p95':>9} {'new p95':>9} {'delta':>8}")
+    for key in sorted(base.keys() & new.keys()):
+        b, n = base[key], new[key]
+        d_rps = float(n["req_per_s"]) / float(b["req_per_s"]) - 1
+        d_p95 = float(n["p95_ms"]) / float(b["p95_ms"]) - 1
+        flag = ""
+        if d_rps < -threshold or d_p95 > threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        print(f"{key[0]:<16} {key[1]:>4} {float(b['req_per_s']):>11.1f} {float(n['req_per_s']):>11.1f} {d_rps:>+8.1%}"
+              f" {float(b['p95_ms']):>9.1f} {float(n['p95_ms']):>9.1f} {d_p95:>+8.1%}{flag}")
+    print(f"\n{regressions} regression(s) beyond {threshold:.0%}")
+    return regressions
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="HTTP load benchmark")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("seed", help="insert a synthetic catalog and invoice history")
+    p.add_argument("--skus", type=int, default=10_000)
+    p.add_argument("--invoices", type=int, default=1_000)
+    p.add_argument("--items-per-invoice", type=int, default=4)
+    p.add_argument("--seed", type=int, default=42)
+    p.add_argument("--reset", action="store_true", help="delete previously seeded data instead")
+    p = sub.add_parser("run", help="drive the routes and write per-route latency percentiles")
+    p.add_argument("--url", default=os.getenv("BENCH_URL", "http://127.0.0.1:8000"))
+    p.add_argument("--concurrency", default="1,4,16", help="comma-separated worker counts")
+    p.add_argument("--duration", type=float, default=20.0, help="measured seconds per level")
+    p.add_argument("--warmup", type=float, default=3.0, help="unmeasured seconds per level")
+    p.add_argument("--routes", default=",".join(ROUTES))
+    p.add_argument("--seed", type=int, default=42)
+    p.add_argument("--out", default=OUT_CSV)
+    p = sub.add_parser("compare", help="diff two result CSVs and flag regressions")
+    p.add_argument("base")
+    p.add_argument("new")
+    p.add_argument("--threshold", type=float, default=0.10)
+    args = parser.parse_args()
+
+    if args.command == "seed":
+        if args.reset:
+            reset()
+        else:
+            seed(args.skus, args.invoices, args.items_per_invoice, random.Random(args.seed))
+    elif args.command == "run":
+        run(args)
+    else:
+        sys.exit(1 if compare(args.base, args.new, args.threshold) else 0)
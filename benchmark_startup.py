@@ -0,0 +1,100 @@
+"""Worker startup benchmark: how long `import app` takes and which modules cost the most.
+
+    python benchmark_startup.py                 # run, write bench_startup_<env>.csv
+    python benchmark_startup.py --top 30        # longer table
+
+Every repeat starts a fresh interpreter with `python -X importtime` for each
+scenario ("app" = what a worker imports, "app+warmup" = also the modules the
+routes load lazily), so nothing is shared between samples. Per top-level package
+the self and cumulative import times are summarised as the median over REPEATS.
+"""
+import argparse, csv, os, statistics, subprocess, sys, time
+from collections import defaultdict
+
+REPEATS = int(os.getenv("REPEATS", "5"))
+ENV_LABEL = os.getenv("BENCH_ENV", "local")
+OUT_CSV = os.getenv("BENCH_OUT", f"bench_startup_{ENV_LABEL}.csv")
+
+SCENARIOS = {
+    "app": "import app",
+    "app+warmup": "import app; app.warmup(connect=False)",
+}
+
+
+def parse_importtime(stderr):
+    """{package: [self_us, cumulative_us]} from `-X importtime` output.
+
+    self is summed over all modules of the top-level package (reportlab.*,
+    PIL.*, ...); cumulative counts each import entered from outside the
+    package, i.e. everything that package pulled in.
+    """
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        if self_us.strip().isdigit():
+            depth = (len(name) - len(name.lstrip())) // 2
+            entries.append((depth, name.strip().split(".", 1)[0], int(self_us), int(cumulative_us)))
+
+    out, stack = {}, []  # stack of (depth, package); parents are printed after their children
+    for depth, package, self_us, cumulative_us in reversed(entries):
+        while stack and stack[-1][0] >= depth:
+            stack.pop()
+        totals = out.setdefault(package, [0, 0])
+        totals[0] += self_us
+        if not stack or stack[-1][1] != package:
+            totals[1] += cumulative_us
+        stack.append((depth, package))
+    return out
+
+
+def run_once(code):
+    """(wall ms for the whole interpreter, parse_importtime() of its imports)."""
+    t0 = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                          capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    wall_ms = (time.perf_counter() - t0) * 1000
+    if proc.returncode != 0:
+        raise SystemExit(f"`{code}` failed:\n{proc.stderr[-2000:]}")
+    return wall_ms, parse_importtime(proc.stderr)
+
+
+def main(top):
+    rows = []
+    for scenario, code in SCENARIOS.items():
+        walls, self_us, cumulative_us = [], defaultdict(list), defaultdict(list)
+        run_once(code)  # warm the OS page cache and .pyc files
+        for _ in range(REPEATS):
+            wall_ms, packages = run_once(code)
+            walls.append(wall_ms)
+            for package, (s, c) in packages.items():
+                self_us[package].append(s)
+                cumulative_us[package].append(c)
+
+        wall = statistics.median(walls)
+        total_ms = sum(statistics.median(v) for v in self_us.values()) / 1000
+        print(f"\n== {scenario}: {wall:.0f} ms wall (interpreter + imports), {total_ms:.0f} ms in imports ==")
+        print(f"{'package':<28}{'self ms':>10}{'cumul ms':>10}{'share':>8}")
+        ranked = sorted(self_us, key=lambda p: statistics.median(self_us[p]), reverse=True)
+        for i, package in enumerate(ranked):
+            s = statistics.median(self_us[package]) / 1000
+            c = statistics.median(cumulative_us[package]) / 1000
+            rows.append({"env": ENV_LABEL, "scenario": scenario, "package": package,
+                         "self_ms": round(s, 2), "cumulative_ms": round(c, 2),
+                         "share_pct": round(100 * s / total_ms, 1) if total_ms else 0,
+                         "wall_ms": round(wall, 1), "repeats": REPEATS})
+            if i < top:
+                print(f"{package:<28}{s:>10.1f}{c:>10.1f}{100 * s / total_ms if total_ms else 0:>7.1f}%")
+
+    with open(OUT_CSV, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f"\nSaved to {OUT_CSV}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import-time benchmark for app.py")
+    parser.add_argument("--top", type=int, default=15, help="packages to print per scenario")
+    main(parser.parse_args().top)
@@ -0,0 +1,429 @@
+"""Bulk product import from supplier spreadsheets (CSV or XLSX).
+
+    report = run_import(repo, open("pemasok.xlsx", "rb"), "xlsx", DirectoryImages("foto/"))
+
+The file is streamed and validated in chunks of IMPORT_CHUNK_ROWS. Valid rows
+are bulk-loaded (COPY on Postgres) into a temporary import_staging table and
+upserted into inventory on product_id with one statement, all in one
+transaction: either every valid row lands or none does. Images named in the
+`image` column are resized on a thread pool while the rows are still being
+loaded, and attached to their products after the upsert has committed.
+
+The report counts rows, inserts and updates, lists every problem per row
+(line numbers as in the spreadsheet) and gives the throughput.
+"""
+import csv
+import io
+import os
+import posixpath
+import re
+import threading
+import time
+import zipfile
+from concurrent.futures import Future, ThreadPoolExecutor
+from decimal import Decimal, InvalidOperation
+
+import images
+from instrumentation import timed
+
+IMPORT_CHUNK_ROWS = int(os.getenv("IMPORT_CHUNK_ROWS", "5000"))
+IMPORT_IMAGE_WORKERS = int(os.getenv("IMPORT_IMAGE_WORKERS", str(min(8, os.cpu_count() or 2))))
+IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", "1000"))  # listed in the report; all are counted
+IMPORT_MAX_IMAGE_MB = int(os.getenv("IMPORT_MAX_IMAGE_MB", "20"))
+
+FORMATS = ("csv", "xlsx")
+STOCK_MODES = ("set", "add")
+STAGING_COLUMNS = ("line", "product_id", "name", "stock", "supplier", "cost_price", "selling_price")
+
+# Header (lower case, spaces -> _) -> column: the names of the inventory export plus the UI's
+HEADER_ALIASES = {
+    "product_id": "product_id", "produk_id": "product_id", "sku": "product_id", "kode": "product_id",
+    "name": "name", "nama": "name",
+    "stock": "stock", "stok": "stock", "qty": "stock", "jumlah": "stock",
+    "supplier": "supplier", "pemasok": "supplier",
+    "cost_price": "cost_price", "harga_modal": "cost_price", "harga_beli": "cost_price",
+    "selling_price": "selling_price", "harga_jual": "selling_price", "harga": "selling_price",
+    "image": "image", "gambar": "image", "foto": "image",
+}
+REQUIRED_COLUMNS = ("product_id", "name")
+
+_RUPIAH = re.compile(r"\d{1,3}(\.\d{3})+(,\d+)?")
+
+
+# -------------------- READING --------------------
+def _csv_rows(fileobj):
+    text = io.TextIOWrapper(fileobj, encoding="utf-8-sig", newline="")
+    first = text.readline()
+    try:
+        # Excel with an Indonesian locale saves CSV with ';'
+        dialect = csv.Sniffer().sniff(first, delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    yield next(csv.reader([first], dialect), [])
+    yield from csv.reader(text, dialect)
+
+
+def _xlsx_rows(fileobj):
+    from openpyxl import load_workbook  # optional dependency, only needed for XLSX
+
+    # read_only streams the sheet XML instead of building the whole workbook
+    wb = load_workbook(fileobj, read_only=True, data_only=True)
+    try:
+        for row in wb.worksheets[0].iter_rows(values_only=True):
+            yield list(row)
+    finally:
+        wb.close()
+
+
+def read_rows(fileobj, fmt):
+    """(line, [cells]) for every row of the first sheet, the header being line 1."""
+    rows = _xlsx_rows(fileobj) if fmt == "xlsx" else _csv_rows(fileobj)
+    try:
+        yield from enumerate(rows, start=1)
+    except UnicodeDecodeError:
+        raise ValueError("CSV files must be UTF-8 (in Excel: save as 'CSV UTF-8').")
+
+
+def map_header(header):
+    """({column: cell index}, [ignored headers]); ValueError if a required column is missing."""
+    columns, ignored = {}, []
+    for i, cell in enumerate(header):
+        key = re.sub(r"[\s-]+", "_", _text(cell).lower())
+        column = HEADER_ALIASES.get(key)
+        if column and column not in columns:
+            columns[column] = i
+        elif key:
+            ignored.append(_text(cell))
+    missing = [c for c in REQUIRED_COLUMNS if c not in columns]
+    if missing:
+        raise ValueError(f"Missing column(s): {', '.join(missing)}. "
+                         f"Known headers: {', '.join(sorted(HEADER_ALIASES))}.")
+    return columns, ignored
+
+
+# -------------------- VALIDATION --------------------
+def _text(value):
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)  # numeric product codes come back from XLSX as 1234.0
+    return str(value).strip()
+
+
+def parse_stock(value):
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    s = _text(value)
+    if _RUPIAH.fullmatch(s) and "," not in s:
+        s = s.replace(".", "")  # "1.200" is a thousand separator
+    try:
+        stock = int(s)
+    except ValueError:
+        raise ValueError("must be a whole number")
+    if stock < 0:
+        raise ValueError("must be 0 or more")
+    return stock
+
+
+def parse_money(value):
+    """Decimal from 15000, 15000.5, "Rp 15.000" or "15.000,50"."""
+    if isinstance(value, (int, float, Decimal)) and not isinstance(value, bool):
+        amount = Decimal(str(value))
+    else:
+        s = re.sub(r"(?i)rp|\s", "", _text(value))
+        if _RUPIAH.fullmatch(s):
+            s = s.replace(".", "").replace(",", ".")
+        elif "," in s and "." not in s:
+            s = s.replace(",", ".")
+        try:
+            amount = Decimal(s)
+        except InvalidOperation:
+            raise ValueError("is not a number")
+    if not amount.is_finite() or amount < 0:
+        raise ValueError("must be 0 or more")
+    return amount
+
+
+def image_ref(value):
+    """Normalised relative path of an image cell; ValueError for URLs, absolute paths or '..'."""
+    ref = _text(value).replace("\\", "/")
+    if "://" in ref:
+        raise ValueError("URLs are not supported, put the file in the images folder/zip")
+    ref = posixpath.normpath(ref)
+    if ref.startswith(("/", "../")) or ref == "..":
+        raise ValueError("must be a path inside the images folder/zip")
+    if ref.rsplit(".", 1)[-1].lower() not in images.ALLOWED_EXTENSIONS:
+        raise ValueError(f"must be one of: {', '.join(sorted(images.ALLOWED_EXTENSIONS))}")
+    return ref
+
+
+def validate_row(values, columns, seen):
+    """(staging values without line, image ref or None, [(column, message)])."""
+    def cell(name):
+        i = columns.get(name)
+        return values[i] if i is not None and i < len(values) else None
+
+    problems = []
+    product_id, name = _text(cell("product_id")), _text(cell("name"))
+    if not product_id:
+        problems.append(("product_id", "product_id is empty"))
+    elif product_id in seen:
+        problems.append(("product_id", f"duplicate product_id, already on line {seen[product_id]}"))
+    if not name:
+        problems.append(("name", "name is empty"))
+
+    parsed = {}
+    for column, parse in (("stock", parse_stock), ("cost_price", parse_money), ("selling_price", parse_money)):
+        raw = cell(column)
+        parsed[column] = None  # blank: 0 for new products, unchanged for existing ones
+        if _text(raw):
+            try:
+                parsed[column] = parse(raw)
+            except ValueError as e:
+                problems.append((column, f"{column} {_text(raw)!r} {e}"))
+
+    image = None
+    if _text(cell("image")):
+        try:
+            image = image_ref(cell("image"))
+        except ValueError as e:
+            problems.append(("image", f"image {_text(cell('image'))!r} {e}"))
+
+    row = (product_id, name, parsed["stock"], _text(cell("supplier")) or None,
+           parsed["cost_price"], parsed["selling_price"])
+    return row, image, problems
+
+
+# -------------------- IMAGES --------------------
+class DirectoryImages:
+    """Image files under a local folder (CLI --images)."""
+
+    def __init__(self, root):
+        self.root = os.path.realpath(root)
+
+    def _path(self, ref):
+        path = os.path.realpath(os.path.join(self.root, ref))
+        if not path.startswith(self.root + os.sep) or not os.path.isfile(path):
+            raise LookupError("not found in the images folder")
+        return path
+
+    def exists(self, ref):
+        try:
+            self._path(ref)
+        except LookupError:
+            return False
+        return True
+
+    def read(self, ref):
+        path = self._path(ref)
+        if os.path.getsize(path) > IMPORT_MAX_IMAGE_MB * 1024 * 1024:
+            raise LookupError(f"larger than {IMPORT_MAX_IMAGE_MB} MB")
+        with open(path, "rb") as f:
+            return f.read()
+
+
+class ZipImages:
+    """Image files inside an uploaded .zip, found by their path or by file name alone."""
+
+    def __init__(self, fileobj):
+        try:
+            self.zip = zipfile.ZipFile(fileobj)
+        except zipfile.BadZipFile:
+            raise ValueError("The images upload must be a .zip file.")
+        self.members = {}
+        for info in self.zip.infolist():
+            if not info.is_dir():
+                self.members.setdefault(info.filename, info)
+                self.members.setdefault(posixpath.basename(info.filename), info)
+
+    def _member(self, ref):
+        info = self.members.get(ref) or self.members.get(posixpath.basename(ref))
+        if info is None:
+            raise LookupError("not found in the images zip")
+        return info
+
+    def exists(self, ref):
+        return (self.members.get(ref) or self.members.get(posixpath.basename(ref))) is not None
+
+    def read(self, ref):
+        info = self._member(ref)
+        if info.file_size > IMPORT_MAX_IMAGE_MB * 1024 * 1024:
+            raise LookupError(f"larger than {IMPORT_MAX_IMAGE_MB} MB")
+        return self.zip.read(info)
+
+
+def _build_image(data):
+    from PIL import UnidentifiedImageError
+
+    try:
+        with timed("image_variants"):
+            return images.build_variants(data)
+    except UnidentifiedImageError:
+        raise ValueError("not a readable image file")
+
+
+class ImageJobs:
+    """Build the variants of every referenced image once, `workers` at a time.
+
+    Files are read on the calling thread (a zip can't be shared between
+    threads); at most 4 per worker wait in memory, so a large zip never
+    sits in RAM at once.
+    """
+
+    def __init__(self, source, workers):
+        self.source = source
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="import-images")
+        self.slots = threading.BoundedSemaphore(workers * 4)
+        self.jobs = {}   # ref -> Future of {variant: url}
+        self.users = {}  # ref -> [(line, product_id)]
+
+    def add(self, ref, line, product_id):
+        self.users.setdefault(ref, []).append((line, product_id))
+        if ref in self.jobs:
+            return
+        try:
+            data = self.source.read(ref)
+        except LookupError as e:
+            self.jobs[ref] = Future()
+            self.jobs[ref].set_exception(e)
+            return
+        self.slots.acquire()
+        job = self.pool.submit(_build_image, data)
+        job.add_done_callback(lambda _: self.slots.release())
+        self.jobs[ref] = job
+
+    def results(self):
+        """([(product_id, image_url, thumb_url)], [(line, product_id, message)])."""
+        done, failed = [], []
+        for ref, job in self.jobs.items():
+            try:
+                urls = job.result()
+            except Exception as e:
+                failed += [(line, pid, f"image {ref!r}: {e}") for line, pid in self.users[ref]]
+                continue
+            done += [(pid, urls["detail"], urls["thumb"]) for _, pid in self.users[ref]]
+        return done, failed
+
+    def close(self):
+        self.pool.shutdown(wait=True, cancel_futures=True)
+
+
+# -------------------- IMPORT --------------------
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def run_import(repo, fileobj, fmt, image_source=None, stock_mode="set", dry_run=False,
+               on_commit=None, chunk_rows=IMPORT_CHUNK_ROWS, image_workers=IMPORT_IMAGE_WORKERS):
+    """Import one spreadsheet into inventory; returns the report dict.
+
+    dry_run validates and runs the upsert without committing (the counts are
+    still exact) and only checks that the images exist. on_commit({name:
+    version}) is called after each commit so the caller can drop its caches.
+    Raises ValueError for problems with the file as a whole; nothing is
+    written then.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of: {', '.join(FORMATS)}")
+    if stock_mode not in STOCK_MODES:
+        raise ValueError(f"stock_mode must be one of: {', '.join(STOCK_MODES)}")
+
+    t0 = time.perf_counter()
+    report = {"dry_run": dry_run, "stock_mode": stock_mode, "rows": 0, "imported": 0, "rejected": 0,
+              "inserted": 0, "updated": 0, "images": 0, "error_count": 0, "errors": [], "warnings": []}
+
+    def reject(line, product_id, column, message):
+        report["error_count"] += 1
+        if len(report["errors"]) < IMPORT_MAX_ERRORS:
+            report["errors"].append({"line": line, "product_id": product_id or None,
+                                     "column": column, "error": message})
+
+    rows = read_rows(fileobj, fmt)
+    header = next(rows, (1, None))[1]
+    if not header:
+        raise ValueError("The file is empty.")
+    columns, ignored = map_header(header)
+    if ignored:
+        report["warnings"].append(f"Ignored column(s): {', '.join(ignored)}.")
+    if "image" in columns and image_source is None:
+        report["warnings"].append("No images folder/zip given, the image column was ignored.")
+        columns = {c: i for c, i in columns.items() if c != "image"}
+    jobs = ImageJobs(image_source, image_workers) if image_source is not None and not dry_run else None
+
+    try:
+        with repo.session() as db:
+            db.create_import_staging()
+            seen = {}  # product_id -> line, duplicates within the file
+            for chunk in _chunks(rows, chunk_rows):
+                valid = []
+                for line, values in chunk:
+                    if not any(_text(v) for v in values):
+                        continue  # blank spreadsheet row
+                    report["rows"] += 1
+                    row, image, problems = validate_row(values, columns, seen)
+                    if problems:
+                        report["rejected"] += 1
+                        for column, message in problems:
+                            reject(line, row[0], column, message)
+                        continue
+                    seen[row[0]] = line
+                    valid.append((line, *row))
+                    if image and dry_run and not image_source.exists(image):
+                        reject(line, row[0], "image", f"image {image!r} not found")
+                    elif image and jobs:
+                        jobs.add(image, line, row[0])
+                with timed("import_load"):
+                    db.copy_rows("import_staging", STAGING_COLUMNS, valid)
+            report["load_s"] = round(time.perf_counter() - t0, 3)
+
+            t1 = time.perf_counter()
+            with timed("import_upsert"):
+                counts = db.upsert_staged_products(stock_mode)
+            report["imported"] = len(seen)
+            report["inserted"], report["updated"] = counts["inserted"], counts["updated"]
+            report["upsert_s"] = round(time.perf_counter() - t1, 3)
+            if not dry_run and seen:
+                versions = {"inventory": db.bump_version("inventory")}
+                if counts["renamed_invoices"]:
+                    versions["invoices"] = db.bump_version("invoices")
+                db.commit()
+                if on_commit:
+                    on_commit(versions)
+            # dry run: the session rolls everything back
+
+        if jobs:
+            t2 = time.perf_counter()
+            done, failed = jobs.results()
+            for line, product_id, message in failed:
+                reject(line, product_id, "image", message)
+            if done:
+                with repo.session() as db:
+                    db.set_images_by_product_id(done)
+                    version = db.bump_version("inventory")
+                    db.commit()
+                if on_commit:
+                    on_commit({"inventory": version})
+            report["images"] = len(done)
+            report["images_s"] = round(time.perf_counter() - t2, 3)
+    finally:
+        if jobs:
+            jobs.close()
+
+    report["total_s"] = round(time.perf_counter() - t0, 3)
+    report["rows_per_s"] = round(report["rows"] / report["total_s"]) if report["total_s"] else None
+    return report
+
+
+def write_errors_csv(report, path):
+    """The report's per-row errors as a CSV (line, product_id, column, error)."""
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=["line", "product_id", "column", "error"])
+        writer.writeheader()
+        writer.writerows(report["errors"])
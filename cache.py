@@ -0,0 +1,220 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from pagination import LIST_COLUMNS
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Small thread-safe LRU cache whose entries also expire after `ttl` seconds."""
+
+    def __init__(self, maxsize=1024, ttl=60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl_s": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 4) if total else None,
+                "evictions": self.evictions,
+            }
+
+
+# -------------------- DATA VERSIONS --------------------
+# One counter row per table in `data_versions` (see schema.py). Writers bump it
+# inside their own transaction (repository session bump_version()), so every
+# gunicorn worker can tell that its cached copy is stale by comparing a single
+# integer.
+
+class DataVersions:
+    """Process-local copy of the whole data_versions table, for ETags.
+
+    Re-read (one tiny query) at most every `check_interval` seconds, so a
+    conditional GET inside that window is answered without the database.
+    Writes made by this worker are applied at once through note().
+    """
+
+    def __init__(self, check_interval=2.0):
+        self.check_interval = check_interval
+        self._rows = {}  # name -> (version, updated_at)
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def snapshot(self, session):
+        """{name: (version, updated_at)}; `session` (repository.session) is only used when the copy is stale."""
+        now = time.monotonic()
+        if now - self._checked_at >= self.check_interval:
+            with session() as db:
+                rows = db.version_rows()
+            with self._lock:
+                self._rows = rows
+                self._checked_at = now
+        with self._lock:
+            return dict(self._rows)
+
+    def note(self, name, version):
+        """Record a version this worker just committed (never moves backwards)."""
+        if version is None:
+            return
+        with self._lock:
+            current = self._rows.get(name)
+            if current is None or version > current[0]:
+                self._rows[name] = (version, datetime.now(timezone.utc))
+
+
+data_versions = DataVersions(check_interval=float(os.getenv("CATALOG_VERSION_CHECK_S", "2")))
+
+
+class CatalogCache:
+    """Read-through cache of inventory rows (by id and product_id) and listing pages.
+
+    Entries are dropped when the `inventory` data version moves. Local writes
+    call invalidate() right after commit; changes made by other workers are
+    noticed within `check_interval` seconds.
+    """
+
+    def __init__(self, maxsize=5000, ttl=300.0, check_interval=2.0):
+        self.products = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.pages = TTLCache(maxsize=max(64, maxsize // 20), ttl=ttl)
+        self.check_interval = check_interval
+        self.version = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.version_checks = 0
+        self.invalidations = 0
+
+    def sync(self, db):
+        """Drop everything if another worker has bumped the inventory version (`db`: repository session)."""
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        version = db.read_version("inventory")
+        with self._lock:
+            self._checked_at = now
+            self.version_checks += 1
+            if version != self.version:
+                self._clear(version)
+
+    def invalidate(self, version=None):
+        with self._lock:
+            self._clear(version)
+        data_versions.note("inventory", version)
+
+    def _clear(self, version):
+        self.products.clear()
+        self.pages.clear()
+        self.version = version
+        self.invalidations += 1
+        if version is None:
+            self._checked_at = 0.0  # unknown version: re-read on next access
+
+    # ---- products ----
+    def _store(self, row):
+        self.products.set(("id", row["id"]), row)
+        self.products.set(("product_id", row["product_id"]), row)
+
+    def get_product(self, db, item_id):
+        return self.get_products(db, [item_id]).get(item_id)
+
+    def get_products(self, db, ids):
+        """{id: row} for the given ids; misses are loaded in one query."""
+        self.sync(db)
+        found, missing = {}, []
+        for item_id in set(ids):
+            row = self.products.get(("id", item_id), _MISSING)
+            if row is _MISSING:
+                missing.append(item_id)
+            elif row is not None:
+                found[item_id] = row
+        if missing:
+            version = self.version
+            found.update(db.products_by_id(missing, LIST_COLUMNS))
+            # Don't cache what was read while an invalidation happened
+            if version == self.version:
+                for item_id in missing:
+                    if item_id in found:
+                        self._store(found[item_id])
+                    else:
+                        self.products.set(("id", item_id), None)
+        return found
+
+    def get_by_product_id(self, db, product_id):
+        self.sync(db)
+        row = self.products.get(("product_id", product_id), _MISSING)
+        if row is not _MISSING:
+            return row
+        version = self.version
+        row = db.product_by_product_id(product_id, LIST_COLUMNS)
+        if version == self.version:
+            if row is None:
+                self.products.set(("product_id", product_id), None)
+            else:
+                self._store(row)
+        return row
+
+    # ---- listing / search pages ----
+    def get_page(self, db, key, loader):
+        """Cached result of `loader()` for `key`; callers must not mutate it."""
+        self.sync(db)
+        page = self.pages.get(key)
+        if page is None:
+            version = self.version
+            page = loader()
+            if version == self.version:
+                self.pages.set(key, page)
+        return page
+
+    def stats(self):
+        return {
+            "version": self.version,
+            "version_checks": self.version_checks,
+            "invalidations": self.invalidations,
+            "products": self.products.stats(),
+            "pages": self.pages.stats(),
+        }
+
+
+catalog_cache = CatalogCache(
+    maxsize=int(os.getenv("CATALOG_CACHE_SIZE", "5000")),
+    ttl=float(os.getenv("CATALOG_CACHE_TTL", "300")),
+    check_interval=float(os.getenv("CATALOG_VERSION_CHECK_S", "2")),
+)
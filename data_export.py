@@ -0,0 +1,137 @@
+"""Streaming CSV / XLSX export of inventory, invoices and invoice lines.
+
+Rows are read in batches of EXPORT_ITERSIZE (a server-side cursor on
+Postgres, see repository.py stream()), so memory stays flat no matter how
+many rows are exported.
+"""
+import csv
+import io
+import os
+import tempfile
+from datetime import date, datetime, timedelta
+
+from field_crypto import decrypt_rows
+
+EXPORT_ITERSIZE = int(os.getenv("EXPORT_ITERSIZE", "2000"))
+FORMATS = ("csv", "xlsx")
+
+# name -> (columns, FROM ... , date column, supplier condition)
+DATASETS = {
+    "inventory": (
+        ["id", "product_id", "name", "stock", "supplier", "cost_price", "selling_price"],
+        "inventory",
+        None,
+        "supplier = %(supplier)s",
+    ),
+    "invoices": (
+        ["id", "customer_name", "created_at", "item_count", "total"],
+        "invoices",
+        "created_at",
+        """EXISTS (SELECT 1 FROM invoice_items ii JOIN inventory inv ON inv.id = ii.product_id
+                   WHERE ii.invoice_id = invoices.id AND inv.supplier = %(supplier)s)""",
+    ),
+    "invoice_lines": (
+        ["i.id AS invoice_id", "i.created_at", "inv.product_id", "inv.name", "inv.supplier",
+         "ii.quantity", "ii.price", "ii.subtotal"],
+        "invoice_items ii JOIN invoices i ON i.id = ii.invoice_id JOIN inventory inv ON inv.id = ii.product_id",
+        "i.created_at",
+        "inv.supplier = %(supplier)s",
+    ),
+    "stock_movements": (
+        ["m.id", "m.moved_at", "m.product_id AS item_id", "inv.product_id", "inv.name", "m.delta", "m.reason",
+         "m.invoice_id"],
+        "stock_movements m LEFT JOIN inventory inv ON inv.id = m.product_id",
+        "m.moved_at",
+        "inv.supplier = %(supplier)s",
+    ),
+}
+
+
+def parse_filters(start, end, supplier):
+    """Validate ISO dates; raises ValueError with a readable message."""
+    try:
+        start = date.fromisoformat(start) if start else None
+        end = date.fromisoformat(end) if end else None
+    except ValueError:
+        raise ValueError("start/end must be dates in YYYY-MM-DD format.")
+    return start, end, (supplier or "").strip() or None
+
+
+def _query(dataset, start=None, end=None, supplier=None):
+    columns, from_sql, date_col, supplier_sql = DATASETS[dataset]
+    conditions, params = [], {}
+    if date_col and start:
+        conditions.append(f"{date_col} >= %(start)s")
+        params["start"] = start
+    if date_col and end:
+        conditions.append(f"{date_col} < %(end)s")  # end date is inclusive
+        params["end"] = end + timedelta(days=1)
+    if supplier:
+        conditions.append(supplier_sql)
+        params["supplier"] = supplier
+    where = " AND ".join(conditions) or "TRUE"
+    order = {"invoice_lines": "ii.id", "stock_movements": "m.id"}.get(dataset, "id")
+    return f"SELECT {', '.join(columns)} FROM {from_sql} WHERE {where} ORDER BY {order}", params
+
+
+def header(dataset):
+    return [c.split(" AS ")[-1].split(".")[-1] for c in DATASETS[dataset][0]]
+
+
+def iter_batches(db, dataset, start=None, end=None, supplier=None, itersize=EXPORT_ITERSIZE):
+    """Yield lists of row tuples from db.stream() (the repository session must stay open)."""
+    sql, params = _query(dataset, start, end, supplier)
+    names = header(dataset)
+    for rows in db.stream(sql, params, itersize):
+        if "customer_name" in names:
+            # decrypt the whole batch in one pass
+            dicts = decrypt_rows([dict(zip(names, r)) for r in rows], ["customer_name"])
+            rows = [tuple(d[n] for n in names) for d in dicts]
+        yield rows
+
+
+def stream_csv(batches, names):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(names)
+    for rows in batches:
+        writer.writerows(rows)
+        yield buf.getvalue().encode()
+        buf.seek(0)
+        buf.truncate()
+    yield buf.getvalue().encode()
+
+
+def _xlsx_value(value):
+    # openpyxl rejects timezone-aware datetimes
+    if isinstance(value, datetime) and value.tzinfo is not None:
+        return value.replace(tzinfo=None)
+    return value
+
+
+def stream_xlsx(batches, names, chunk_size=64 * 1024):
+    """XLSX via openpyxl's write-only mode (rows go straight to a temp file), then streamed."""
+    from openpyxl import Workbook  # optional dependency, only needed for XLSX
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(names)
+    for rows in batches:
+        for row in rows:
+            ws.append([_xlsx_value(v) for v in row])
+    with tempfile.TemporaryFile() as tmp:
+        wb.save(tmp)
+        tmp.seek(0)
+        while True:
+            chunk = tmp.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+def export(session, dataset, fmt="csv", start=None, end=None, supplier=None):
+    """Generator of file chunks; holds one repository session until it is exhausted."""
+    with session() as db:
+        batches = iter_batches(db, dataset, start, end, supplier)
+        writer = stream_xlsx if fmt == "xlsx" else stream_csv
+        yield from writer(batches, header(dataset))
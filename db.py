@@ -0,0 +1,205 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+
+from instrumentation import TimedConnection, pool_acquire_seconds
+
+# Cursor timing for /metrics; DB_TIMING=0 uses plain psycopg2 connections
+CONNECTION_FACTORY = TimedConnection if os.getenv("DB_TIMING", "1") == "1" else None
+
+
+class PoolTimeout(RuntimeError):
+    """Raised when no connection becomes free within DB_POOL_TIMEOUT."""
+
+
+class ConnectionPool:
+    """Thread-safe psycopg2 pool that blocks (instead of failing) when exhausted.
+
+    Idle connections are health-checked on checkout; broken ones are discarded
+    and replaced transparently.
+    """
+
+    def __init__(self, dsn, minconn=1, maxconn=10, timeout=10.0, check_after=30.0):
+        if minconn > maxconn:
+            raise ValueError("minconn must not exceed maxconn")
+        self.dsn = dsn
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.check_after = check_after  # only ping connections idle longer than this
+        self._idle = []  # [(conn, returned_at)]
+        self._size = 0
+        self._cond = threading.Condition()
+        self._stats = {
+            "checkouts": 0,
+            "waits": 0,
+            "wait_time_s": 0.0,
+            "timeouts": 0,
+            "created": 0,
+            "discarded": 0,
+        }
+        for _ in range(minconn):
+            self._idle.append((self._connect(), time.monotonic()))
+            self._size += 1
+            self._stats["created"] += 1
+
+    def _connect(self):
+        return psycopg2.connect(self.dsn, connection_factory=CONNECTION_FACTORY)
+
+    def _healthy(self, conn, idle_for):
+        if conn.closed:
+            return False
+        if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+            return False
+        if idle_for < self.check_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn):
+        # caller holds self._cond
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+        self._size -= 1
+        self._stats["discarded"] += 1
+        self._cond.notify()
+
+    def getconn(self):
+        t0 = time.monotonic()
+        deadline = t0 + self.timeout
+        waited = False
+        while True:
+            conn, returned_at = None, None
+            with self._cond:
+                while not self._idle and self._size >= self.maxconn:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise PoolTimeout(f"No database connection available within {self.timeout}s")
+                    if not waited:
+                        waited = True
+                        self._stats["waits"] += 1
+                    self._cond.wait(remaining)
+                if self._idle:
+                    conn, returned_at = self._idle.pop()
+                else:
+                    self._size += 1  # reserve the slot, connect outside the lock
+
+            # Connecting and pinging happen without holding the lock
+            if conn is None:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+                with self._cond:
+                    self._stats["created"] += 1
+            elif not self._healthy(conn, time.monotonic() - returned_at):
+                with self._cond:
+                    self._discard(conn)
+                continue
+
+            with self._cond:
+                self._stats["checkouts"] += 1
+                if waited:
+                    self._stats["wait_time_s"] += time.monotonic() - t0
+            return conn
+
+    def putconn(self, conn, discard=False):
+        with self._cond:
+            if not discard and not conn.closed:
+                # Never hand out a connection with a half-finished transaction
+                try:
+                    if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                        conn.rollback()
+                except psycopg2.Error:
+                    discard = True
+            if discard or conn.closed:
+                self._discard(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+
+    def closeall(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            for conn, _ in idle:
+                self._discard(conn)
+
+    def stats(self):
+        with self._cond:
+            return {
+                **self._stats,
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "min": self.minconn,
+                "max": self.maxconn,
+            }
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return the process-wide pool, creating it lazily (and again after a fork)."""
+    global _pool, _pool_pid
+    if _pool is not None and _pool_pid == os.getpid():
+        return _pool
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            database_url = os.getenv("DATABASE_URL")
+            if not database_url:
+                raise RuntimeError("DATABASE_URL is not set")
+            _pool = ConnectionPool(
+                database_url,
+                minconn=int(os.getenv("DB_POOL_MIN", "1")),
+                maxconn=int(os.getenv("DB_POOL_MAX", "10")),
+                timeout=float(os.getenv("DB_POOL_TIMEOUT", "10")),
+                check_after=float(os.getenv("DB_POOL_CHECK_AFTER", "30")),
+            )
+            _pool_pid = os.getpid()
+    return _pool
+
+
+@contextmanager
+def get_db():
+    """Borrow a pooled connection.
+
+    Rolls back on exception; anything left uncommitted when the block exits is
+    rolled back as well, so callers must ``conn.commit()`` explicitly.
+    """
+    pool = get_pool()
+    t0 = time.perf_counter()
+    conn = pool.getconn()
+    pool_acquire_seconds.observe(time.perf_counter() - t0)
+    broken = False
+    try:
+        yield conn
+    except Exception:
+        try:
+            conn.rollback()
+        except psycopg2.Error:
+            broken = True
+        raise
+    finally:
+        pool.putconn(conn, discard=broken or conn.closed != 0)
+
+
+def pool_stats():
+    return get_pool().stats() if _pool is not None else {}
@@ -1,8 +1,21 @@
 import os
+from functools import lru_cache
+
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
 
+NONCE_SIZE = 12
+
+ALGORITHMS = {
+    "aesgcm": AESGCM,
+    "chacha": ChaCha20Poly1305,
+}
+
 def _nonce() -> bytes:
-    return os.urandom(12)
+    return os.urandom(NONCE_SIZE)
+
+# -------------------- PER-CALL API --------------------
+# Builds a new keyed primitive every call. Kept for existing callers and as
+# the baseline in benchmark_encryption.py; new code should use get_cipher().
 
 def aesgcm_encrypt(key: bytes, plaintext: bytes, aad: bytes = b"") -> tuple[bytes, bytes]:
     aesgcm = AESGCM(key)
@@ -23,3 +36,55 @@ def chacha_encrypt(key: bytes, plaintext: bytes, aad: bytes = b"") -> tuple[byte
 def chacha_decrypt(key: bytes, nonce: bytes, ciphertext: bytes, aad: bytes = b"") -> bytes:
     chacha = ChaCha20Poly1305(key)
     return chacha.decrypt(nonce, ciphertext, aad)
+
+# -------------------- CIPHER OBJECTS --------------------
+
+def _nonces(n: int) -> list[bytes]:
+    """`n` random 96-bit nonces from one os.urandom() call.
+
+    Random per message, like _nonce(): a counter would repeat across
+    processes and restarts that share a key, which breaks AES-GCM and
+    ChaCha20-Poly1305 outright. Keep well under 2**32 messages per key.
+    """
+    data = os.urandom(NONCE_SIZE * n)
+    return [data[i:i + NONCE_SIZE] for i in range(0, len(data), NONCE_SIZE)]
+
+
+class AEADCipher:
+    """A keyed AES-GCM / ChaCha20-Poly1305 primitive that is reused across calls."""
+
+    def __init__(self, key: bytes, algorithm: str = "aesgcm"):
+        try:
+            self._aead = ALGORITHMS[algorithm](key)
+        except KeyError:
+            raise ValueError(f"Unknown algorithm: {algorithm}") from None
+        self.algorithm = algorithm
+
+    def encrypt(self, plaintext: bytes, aad: bytes = b"") -> tuple[bytes, bytes]:
+        n = _nonce()
+        return n, self._aead.encrypt(n, plaintext, aad)
+
+    def decrypt(self, nonce: bytes, ciphertext: bytes, aad: bytes = b"") -> bytes:
+        return self._aead.decrypt(nonce, ciphertext, aad)
+
+    def encrypt_many(self, plaintexts, aad: bytes = b"") -> list[tuple[bytes, bytes]]:
+        """Encrypt a list of bytes-like objects; all nonces come from one os.urandom() call."""
+        plaintexts = list(plaintexts)
+        enc = self._aead.encrypt
+        return [(n, enc(n, pt, aad)) for n, pt in zip(_nonces(len(plaintexts)), plaintexts)]
+
+    def decrypt_many(self, items, aad: bytes = b"") -> list[bytes]:
+        """Decrypt (nonce, ciphertext) pairs; raises InvalidTag on the first bad one."""
+        dec = self._aead.decrypt
+        return [dec(n, ct, aad) for n, ct in items]
+
+    def encrypt_buffer(self, buffer, record_size: int, aad: bytes = b"") -> list[tuple[bytes, bytes]]:
+        """Split one buffer into `record_size` records and encrypt each (no copies)."""
+        view = memoryview(buffer)
+        return self.encrypt_many((view[i:i + record_size] for i in range(0, len(view), record_size)), aad)
+
+
+@lru_cache(maxsize=32)
+def get_cipher(algorithm: str, key: bytes) -> AEADCipher:
+    """Shared AEADCipher for (algorithm, key); building the primitive happens once."""
+    return AEADCipher(key, algorithm)
@@ -0,0 +1,219 @@
+"""Field-level encryption for customer data stored in the database.
+
+Encrypted values are plain strings of the form::
+
+    enc:v1:<scheme>:<key_id>:<base64(nonce || ciphertext)>
+
+so each value carries the algorithm and key it was written with. Old keys stay
+readable as long as they are listed in FIELD_KEYS; new writes always use the
+active key. Values without the prefix (rows written before encryption was
+enabled) are returned unchanged.
+"""
+import base64
+import binascii
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# cryptography (via encryption_schemes) is imported on first encrypt/decrypt,
+# so plaintext pages and workers that never touch customer data don't load it.
+PREFIX = "enc:v1:"
+SCHEMES = ("aesgcm", "chacha")  # keys of encryption_schemes.ALGORITHMS
+
+
+class FieldDecryptError(ValueError):
+    pass
+
+
+def _parse_keys(spec):
+    """'k2:<b64>,k1:<b64>' -> {"k2": key, "k1": key} (in listed order)."""
+    keys = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        key_id, _, b64 = part.partition(":")
+        key = base64.b64decode(b64)
+        if len(key) != 32:
+            raise RuntimeError(f"FIELD_KEYS: key {key_id!r} must be 32 bytes (base64)")
+        keys[key_id] = key
+    return keys
+
+
+class FieldCrypto:
+    def __init__(self, keys, active_key_id=None, scheme="aesgcm", workers=0, parallel_min=256):
+        if scheme not in SCHEMES:
+            raise RuntimeError(f"Unknown FIELD_SCHEME: {scheme}")
+        if active_key_id is not None and active_key_id not in keys:
+            raise RuntimeError(f"FIELD_KEY_ID {active_key_id!r} is not in the key ring")
+        self.keys = keys
+        self.active_key_id = active_key_id if active_key_id is not None else next(iter(keys), None)
+        self.scheme = scheme
+        self.workers = workers
+        self.parallel_min = parallel_min
+        self._executor = None
+        self._lock = threading.Lock()
+        self.encrypted = 0
+        self.decrypted = 0
+        self.batches = 0
+        self.encrypt_s = 0.0
+        self.decrypt_s = 0.0
+        self.max_batch_ms = 0.0
+
+    def _cipher(self, scheme, key_id):
+        from encryption_schemes import get_cipher
+
+        try:
+            return get_cipher(scheme, self.keys[key_id])
+        except KeyError:
+            raise FieldDecryptError(f"Unknown key id {key_id!r} (missing from FIELD_KEYS?)") from None
+
+    @property
+    def active_prefix(self):
+        return f"{PREFIX}{self.scheme}:{self.active_key_id}:"
+
+    def needs_rotation(self, value):
+        """True if `value` is plaintext or was written with another scheme/key."""
+        return value is not None and not value.startswith(self.active_prefix)
+
+    # ---- encrypt ----
+    def encrypt(self, value, field):
+        if value is None:
+            return None
+        if self.active_key_id is None:
+            raise RuntimeError("No field encryption key configured (FIELD_KEYS or APP_AES_KEY_B64)")
+        t0 = time.perf_counter()
+        nonce, ct = self._cipher(self.scheme, self.active_key_id).encrypt(value.encode(), field.encode())
+        out = self.active_prefix + base64.b64encode(nonce + ct).decode()
+        with self._lock:
+            self.encrypted += 1
+            self.encrypt_s += time.perf_counter() - t0
+        return out
+
+    # ---- decrypt ----
+    def _split(self, value):
+        from encryption_schemes import NONCE_SIZE
+
+        try:
+            scheme, key_id, b64 = value[len(PREFIX):].split(":", 2)
+            raw = base64.b64decode(b64, validate=True)
+        except (ValueError, binascii.Error):
+            raise FieldDecryptError("Malformed encrypted value") from None
+        return scheme, key_id, raw[:NONCE_SIZE], raw[NONCE_SIZE:]
+
+    def decrypt(self, value, field):
+        if value is None or not value.startswith(PREFIX):
+            return value
+        return self._decrypt_batch([value], field)[0]
+
+    def _decrypt_batch(self, values, field):
+        """Decrypt encrypted strings of one column; one decrypt_many per (scheme, key)."""
+        from cryptography.exceptions import InvalidTag
+
+        t0 = time.perf_counter()
+        aad = field.encode()
+        groups = {}
+        for i, value in enumerate(values):
+            scheme, key_id, nonce, ct = self._split(value)
+            groups.setdefault((scheme, key_id), ([], []))
+            groups[(scheme, key_id)][0].append(i)
+            groups[(scheme, key_id)][1].append((nonce, ct))
+
+        out = [None] * len(values)
+        for (scheme, key_id), (positions, pairs) in groups.items():
+            cipher = self._cipher(scheme, key_id)
+            try:
+                plain = self._run(cipher, pairs, aad)
+            except InvalidTag:
+                raise FieldDecryptError(f"Authentication failed for {field} (key {key_id!r})") from None
+            for i, pt in zip(positions, plain):
+                out[i] = pt.decode()
+
+        elapsed = time.perf_counter() - t0
+        with self._lock:
+            self.decrypted += len(values)
+            self.batches += 1
+            self.decrypt_s += elapsed
+            self.max_batch_ms = max(self.max_batch_ms, elapsed * 1000)
+        return out
+
+    def _run(self, cipher, pairs, aad):
+        if self.workers <= 1 or len(pairs) < self.parallel_min:
+            return cipher.decrypt_many(pairs, aad)
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="field-decrypt")
+        step = -(-len(pairs) // self.workers)
+        chunks = [pairs[i:i + step] for i in range(0, len(pairs), step)]
+        results = self._executor.map(lambda chunk: cipher.decrypt_many(chunk, aad), chunks)
+        return [pt for chunk in results for pt in chunk]
+
+    def decrypt_rows(self, rows, columns, table="invoices"):
+        """Decrypt `columns` of every row (dicts, in place) in one batched pass per column."""
+        for column in columns:
+            field = f"{table}.{column}"
+            hits = [row for row in rows if (row.get(column) or "").startswith(PREFIX)]
+            if hits:
+                for row, value in zip(hits, self._decrypt_batch([row[column] for row in hits], field)):
+                    row[column] = value
+        return rows
+
+    def stats(self):
+        with self._lock:
+            return {
+                "scheme": self.scheme,
+                "active_key_id": self.active_key_id,
+                "key_ids": list(self.keys),
+                "encrypted": self.encrypted,
+                "decrypted": self.decrypted,
+                "decrypt_batches": self.batches,
+                "encrypt_ms_total": round(self.encrypt_s * 1000, 3),
+                "decrypt_ms_total": round(self.decrypt_s * 1000, 3),
+                "decrypt_us_per_value": round(self.decrypt_s * 1e6 / self.decrypted, 2) if self.decrypted else None,
+                "max_batch_ms": round(self.max_batch_ms, 3),
+            }
+
+
+_field_crypto = None
+_field_crypto_lock = threading.Lock()
+
+
+def get_field_crypto():
+    """Process-wide FieldCrypto built from the environment on first use.
+
+    FIELD_KEYS lists "<key_id>:<base64 key>" pairs; FIELD_KEY_ID selects the one
+    used for new writes (default: the first). Without FIELD_KEYS the existing
+    APP_AES_KEY_B64 / APP_CHACHA_KEY_B64 keys are used under the ids "aes" and
+    "chacha", matching FIELD_SCHEME.
+    """
+    global _field_crypto
+    if _field_crypto is not None:
+        return _field_crypto
+    with _field_crypto_lock:
+        if _field_crypto is None:
+            scheme = os.getenv("FIELD_SCHEME", "aesgcm")
+            keys = _parse_keys(os.getenv("FIELD_KEYS", ""))
+            active = os.getenv("FIELD_KEY_ID") or None
+            if not keys:
+                for key_id, env in (("aes", "APP_AES_KEY_B64"), ("chacha", "APP_CHACHA_KEY_B64")):
+                    key = base64.b64decode(os.getenv(env, ""))
+                    if len(key) == 32:
+                        keys[key_id] = key
+                default = "aes" if scheme == "aesgcm" else "chacha"
+                active = active or (default if default in keys else None)
+            _field_crypto = FieldCrypto(
+                keys, active, scheme,
+                workers=int(os.getenv("FIELD_DECRYPT_WORKERS", "0")),
+                parallel_min=int(os.getenv("FIELD_DECRYPT_PARALLEL_MIN", "256")),
+            )
+    return _field_crypto
+
+
+def encrypt_field(value, field):
+    return get_field_crypto().encrypt(value, field)
+
+
+def decrypt_field(value, field):
+    return get_field_crypto().decrypt(value, field)
+
+
+def decrypt_rows(rows, columns, table="invoices"):
+    return get_field_crypto().decrypt_rows(rows, columns, table)
@@ -0,0 +1,25 @@
+"""Gunicorn settings (picked up automatically from the working directory).
+
+    GUNICORN_PRELOAD=1  import the app once in the master and fork workers from it
+                        (shared memory, faster respawns; code reloads need a restart)
+    WARMUP=1            each worker loads the lazy modules, keys and pool connections
+                        before taking requests (see app.warmup)
+"""
+import os
+
+preload_app = os.getenv("GUNICORN_PRELOAD", "0") == "1"
+WARMUP = os.getenv("WARMUP", "0") == "1"
+
+
+def when_ready(server):
+    # Master process: with preload the heavy imports are done once here and
+    # inherited by every worker. No database connections before the fork.
+    if preload_app and WARMUP:
+        from app import warmup
+        warmup(connect=False)
+
+
+def post_worker_init(worker):
+    if WARMUP:
+        from app import warmup
+        warmup(connect=True)
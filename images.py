@@ -0,0 +1,178 @@
+import hashlib
+import io
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+UPLOAD_DIR = os.path.join("static", "uploads")
+UPLOAD_URL = "/static/uploads"
+ALLOWED_EXTENSIONS = {"png", "jpg", "jpeg", "gif", "webp"}
+
+# Content-addressed files: <ab>/<cd>/<sha256>_<variant>.<ext>. The URL changes
+# whenever the bytes do, so these can be cached forever by browsers.
+HASHED_PATH_RE = re.compile(r"^[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}_[a-z]+\.[a-z0-9]+$")
+
+# name -> bounding box. Rendered largest first, each from the previous one.
+VARIANTS = {
+    "detail": (800, 800),   # image modal / invoice detail
+    "thumb": (120, 120),    # table thumbnails
+}
+VARIANT_FORMAT = os.getenv("IMAGE_FORMAT", "WEBP").upper()
+VARIANT_QUALITY = int(os.getenv("IMAGE_QUALITY", "80"))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _rel_path(digest, name, ext):
+    return f"{digest[:2]}/{digest[2:4]}/{digest}_{name}.{ext}"
+
+
+def _variant_ext():
+    return "webp" if VARIANT_FORMAT == "WEBP" else VARIANT_FORMAT.lower()
+
+
+def existing_variants(digest):
+    """{name: url} if every variant for these bytes is already on disk, else None.
+
+    Reused files get a fresh mtime, so gc-uploads treats them as new uploads
+    (within its grace period) until the row that references them is committed.
+    """
+    urls = {}
+    for name in VARIANTS:
+        rel = _rel_path(digest, name, _variant_ext())
+        try:
+            os.utime(os.path.join(UPLOAD_DIR, rel))
+        except FileNotFoundError:
+            return None
+        urls[name] = f"{UPLOAD_URL}/{rel}"
+    return urls
+
+
+def save_original(data, digest, ext):
+    """Store the raw upload so the product has an image until its variants exist."""
+    rel = _rel_path(digest, "orig", ext)
+    path = os.path.join(UPLOAD_DIR, rel)
+    try:
+        os.utime(path)  # already stored: refresh it for gc-uploads' grace period
+    except FileNotFoundError:
+        _write_atomic(path, data)
+    return f"{UPLOAD_URL}/{rel}"
+
+
+def _open_for_resize(data, largest):
+    from PIL import Image, ImageOps  # only workers that resize uploads pay for Pillow
+
+    img = Image.open(io.BytesIO(data))
+    if img.format == "JPEG":
+        # Let libjpeg decode at 1/2, 1/4 or 1/8 scale instead of full resolution
+        img.draft("RGB", largest)
+    img = ImageOps.exif_transpose(img)
+    if img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGBA" if "A" in img.getbands() or "transparency" in img.info else "RGB")
+    return img
+
+
+def build_variants(data, digest=None):
+    """Render every VARIANTS size for the image bytes; returns {name: url}.
+
+    Skips all work when the same bytes were processed before.
+    thumbnail(reducing_gap=...) uses Image.reduce() for the bulk of the
+    downscale, which is much cheaper than a full-quality resample.
+    """
+    digest = digest or content_hash(data)
+    urls = existing_variants(digest)
+    if urls is not None:
+        return urls
+    ordered = sorted(VARIANTS.items(), key=lambda kv: kv[1][0] * kv[1][1], reverse=True)
+    img = _open_for_resize(data, ordered[0][1])
+    urls = {}
+    for name, size in ordered:
+        img = img.copy()
+        img.thumbnail(size, reducing_gap=2.0)
+        buf = io.BytesIO()
+        img.save(buf, VARIANT_FORMAT, quality=VARIANT_QUALITY, method=4)
+        rel = _rel_path(digest, name, _variant_ext())
+        _write_atomic(os.path.join(UPLOAD_DIR, rel), buf.getvalue())
+        urls[name] = f"{UPLOAD_URL}/{rel}"
+    return urls
+
+
+def is_immutable_path(path):
+    """True for request paths of content-addressed files under UPLOAD_URL."""
+    prefix = UPLOAD_URL + "/"
+    return path.startswith(prefix) and HASHED_PATH_RE.match(path[len(prefix):]) is not None
+
+
+def _url_to_rel(url):
+    """Path relative to UPLOAD_DIR for a stored image URL (also legacy forms)."""
+    url = url.split("?", 1)[0]
+    marker = UPLOAD_URL + "/"
+    if marker in url:
+        return url.split(marker, 1)[1]
+    return url.lstrip("/").removeprefix("uploads/")
+
+
+def collect_garbage(referenced_urls, grace_seconds=24 * 3600, dry_run=False):
+    """Delete upload files that no row references; returns (removed_paths, freed_bytes).
+
+    Files younger than `grace_seconds` are kept: an upload is written before
+    the row that points at it is committed.
+    """
+    keep = {_url_to_rel(u).replace("/", os.sep) for u in referenced_urls if u}
+    cutoff = time.time() - grace_seconds
+    removed, freed = [], 0
+    for root, _dirs, files in os.walk(UPLOAD_DIR):
+        for name in files:
+            path = os.path.join(root, name)
+            rel = os.path.relpath(path, UPLOAD_DIR)
+            if rel in keep:
+                continue
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if st.st_mtime > cutoff:
+                continue
+            if not dry_run:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+            removed.append(path)
+            freed += st.st_size
+    return removed, freed
+
+
+def submit(fn, *args):
+    """Run an image job on the shared worker pool (created lazily, per process)."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=int(os.getenv("IMAGE_WORKERS", "2")),
+                thread_name_prefix="image-pipeline",
+            )
+    return _executor.submit(fn, *args)
@@ -0,0 +1,243 @@
+"""Request, SQL and background-task timing, exported in Prometheus text format.
+
+Metrics live in process memory, so under gunicorn every worker reports its
+own numbers; Prometheus adds them up across scrape targets (or scrape each
+worker through a sidecar). Nothing here touches the database.
+"""
+import cProfile
+import logging
+import os
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from psycopg2 import extensions
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "0"))  # 0 = slow query log off
+PROFILE_ROUTES = {r for r in os.getenv("PROFILE_ROUTES", "").split(",") if r}
+PROFILE_SAMPLE = float(os.getenv("PROFILE_SAMPLE", "0.01"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join("cache", "profiles"))
+
+slow_log = logging.getLogger("inventory.slow_query")
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labelnames = name, help, tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, seconds, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        i = bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            if i < len(self.buckets):
+                series[i] += 1
+            series[-2] += seconds
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._series.items())
+        for key, series in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, series):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, ('le', repr(bound)))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, ('le', '+Inf'))} {series[-1]}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {series[-2]}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {series[-1]}")
+        return lines
+
+
+REGISTRY = []
+_collectors = []  # callables returning [(name, help, value)] gauges at scrape time
+
+request_seconds = Histogram("http_request_duration_seconds", "Time spent handling a request.",
+                            ["endpoint", "method", "status"])
+query_seconds = Histogram("db_query_duration_seconds", "Time spent in cursor.execute().", ["op"])
+query_rows = Counter("db_query_rows_total", "Rows returned or affected by queries.", ["op"])
+slow_queries = Counter("db_slow_queries_total", "Queries slower than SLOW_QUERY_MS.", ["op"])
+pool_acquire_seconds = Histogram("db_pool_acquire_seconds", "Time waiting for a pooled connection.")
+task_seconds = Histogram("task_duration_seconds", "PDF rendering, image processing and other jobs.",
+                         ["task"], buckets=DEFAULT_BUCKETS + (30.0, 60.0))
+
+
+def register_collector(fn):
+    _collectors.append(fn)
+
+
+def render_metrics():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    for collect in _collectors:
+        for name, help, value in collect():
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} gauge", f"{name} {value}"]
+    return "\n".join(lines) + "\n"
+
+
+@contextmanager
+def timed(task):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        task_seconds.observe(time.perf_counter() - t0, task=task)
+
+
+# -------------------- PER-REQUEST STATE --------------------
+_local = threading.local()
+
+
+def _request_state():
+    return getattr(_local, "state", None)
+
+
+# -------------------- SQL TIMING --------------------
+
+def _op(query):
+    if isinstance(query, bytes):
+        query = query.decode(errors="replace")
+    word = str(query).lstrip().split(None, 1)
+    return word[0].upper() if word else "OTHER"
+
+
+class _TimedCursorMixin:
+    def execute(self, query, vars=None):
+        t0 = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            observe_query(self, query, time.perf_counter() - t0)
+
+    def executemany(self, query, vars_list):
+        t0 = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            observe_query(self, query, time.perf_counter() - t0)
+
+
+def observe_query(cursor, query, elapsed):
+    op = _op(query)
+    query_seconds.observe(elapsed, op=op)
+    if cursor.rowcount > 0:
+        query_rows.inc(cursor.rowcount, op=op)
+    state = _request_state()
+    if state is not None:
+        state["db_s"] += elapsed
+        state["queries"] += 1
+    if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS:
+        slow_queries.inc(op=op)
+        sql = cursor.query.decode(errors="replace") if cursor.query else str(query)
+        slow_log.warning("slow query %.1f ms (%s rows) [%s]: %s", elapsed * 1000, cursor.rowcount,
+                         state["endpoint"] if state else "-", " ".join(sql.split())[:2000])
+
+
+_timed_classes = {}
+
+
+def _timed_class(cls):
+    timed_cls = _timed_classes.get(cls)
+    if timed_cls is None:
+        timed_cls = _timed_classes[cls] = type("Timed" + cls.__name__, (_TimedCursorMixin, cls), {})
+    return timed_cls
+
+
+class TimedConnection(extensions.connection):
+    """psycopg2 connection whose cursors (any cursor_factory) report to the metrics."""
+
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.pop("cursor_factory", None) or self.cursor_factory or extensions.cursor
+        kwargs["cursor_factory"] = _timed_class(factory)
+        return super().cursor(*args, **kwargs)
+
+
+# -------------------- FLASK --------------------
+
+def init_app(app):
+    """Time every request, add a Server-Timing header, and serve /metrics."""
+    from flask import Response, request
+
+    @app.before_request
+    def _start_timer():
+        _local.state = {"t0": time.perf_counter(), "db_s": 0.0, "queries": 0,
+                        "endpoint": request.endpoint or "unmatched", "profiler": None}
+        if request.endpoint in PROFILE_ROUTES and random.random() < PROFILE_SAMPLE:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+                _local.state["profiler"] = profiler
+            except ValueError:
+                pass  # another profiler is active in this process
+
+    @app.after_request
+    def _server_timing(response):
+        state = _request_state()
+        if state is not None:
+            state["status"] = response.status_code
+            total = (time.perf_counter() - state["t0"]) * 1000
+            response.headers["Server-Timing"] = (
+                f'app;dur={total:.1f}, db;dur={state["db_s"] * 1000:.1f};desc="{state["queries"]} queries"')
+        return response
+
+    @app.teardown_request
+    def _stop_timer(exc):
+        state = _request_state()
+        _local.state = None
+        if state is None:
+            return
+        status = 500 if exc is not None else state.get("status", "")
+        request_seconds.observe(time.perf_counter() - state["t0"], endpoint=state["endpoint"],
+                                method=request.method, status=status)
+        if state["profiler"] is not None:
+            state["profiler"].disable()
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            state["profiler"].dump_stats(os.path.join(
+                PROFILE_DIR, f"{state['endpoint']}-{int(time.time() * 1000)}-{os.getpid()}.prof"))
+
+    @app.route("/metrics")
+    def metrics():
+        return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
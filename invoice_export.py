@@ -0,0 +1,123 @@
+import os
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+
+from field_crypto import decrypt_rows
+from pdf_cache import pdf_cache
+
+EXPORT_WORKERS = int(os.getenv("PDF_EXPORT_WORKERS", "0")) or (os.cpu_count() or 1)
+
+
+def fetch_invoices(db, ids=None, start=None, end=None):
+    """All requested invoices with their items, in two queries.
+
+    `start`/`end` are dates; `end` is inclusive. Returns [(invoice, items)]
+    as plain dicts (picklable for the render processes), oldest first.
+    """
+    conditions, params = [], {}
+    if ids:
+        conditions.append(f"id {db.in_array('%(ids)s')}")
+        params["ids"] = list(ids)
+    if start:
+        conditions.append("created_at >= %(start)s")
+        params["start"] = start
+    if end:
+        conditions.append("created_at < %(end)s")
+        params["end"] = end + timedelta(days=1)
+    where = " AND ".join(conditions) or "TRUE"
+
+    with db.cursor() as cur:
+        cur.execute(f"SELECT * FROM invoices WHERE {where} ORDER BY created_at, id", params)
+        invoices = [dict(row) for row in cur.fetchall()]
+        if not invoices:
+            return []
+        decrypt_rows(invoices, ["customer_name"])
+        cur.execute(f"""
+            SELECT ii.*, inv.name
+            FROM invoice_items ii
+            JOIN inventory inv ON ii.product_id = inv.id
+            WHERE ii.invoice_id {db.in_array('%s')}
+            ORDER BY ii.invoice_id, ii.id
+        """, ([inv["id"] for inv in invoices],))
+        items = {}
+        for row in cur.fetchall():
+            items.setdefault(row["invoice_id"], []).append(dict(row))
+    return [(inv, items.get(inv["id"], [])) for inv in invoices]
+
+
+def _render(bundle):
+    from pdf_render import render_invoice_pdf  # ReportLab loads in the render processes only
+
+    invoice, items = bundle
+    return render_invoice_pdf(invoice, items)
+
+
+def render_many(bundles, workers=EXPORT_WORKERS):
+    """Yield (invoice, pdf_bytes) in input order.
+
+    Cached PDFs are reused; the rest are rendered in a process pool. Only a
+    small window of renders is in flight at once, so memory stays bounded
+    no matter how many invoices are exported.
+    """
+    window = max(1, workers) * 4
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=max(1, workers)) as pool:
+        for invoice, items in bundles:
+            cached = pdf_cache.get(invoice["id"], invoice["version"])
+            if cached is not None:
+                pending.append((invoice, cached, None))
+            else:
+                pending.append((invoice, None, pool.submit(_render, (invoice, items))))
+            while len(pending) >= window:
+                yield _collect(pending.popleft())
+        while pending:
+            yield _collect(pending.popleft())
+
+
+def _collect(entry):
+    invoice, cached, future = entry
+    if future is None:
+        with cached:  # opened by pdf_cache.get(), so eviction meanwhile doesn't matter
+            return invoice, cached.read()
+    return invoice, future.result()
+
+
+class _ZipSink:
+    """Write-only, non-seekable file object; ZipFile falls back to streaming mode."""
+
+    def __init__(self):
+        self._buf = bytearray()
+
+    def write(self, data):
+        self._buf += data
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = bytes(self._buf)
+        self._buf.clear()
+        return data
+
+
+def stream_zip(rendered):
+    """Turn (invoice, pdf_bytes) pairs into ZIP archive chunks, one PDF at a time."""
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for invoice, data in rendered:
+            created = invoice.get("created_at")
+            info = zipfile.ZipInfo(
+                f"nota_{invoice['id']}.pdf",
+                date_time=created.timetuple()[:6] if created else (1980, 1, 1, 0, 0, 0),
+            )
+            info.compress_type = zipfile.ZIP_DEFLATED
+            zf.writestr(info, data)
+            yield sink.drain()
+    yield sink.drain()  # central directory
+
+
+def export_zip(bundles, workers=EXPORT_WORKERS):
+    return stream_zip(render_many(bundles, workers=workers))
@@ -0,0 +1,135 @@
+import base64
+import json
+import os
+from decimal import Decimal
+
+PAGE_SIZE = int(os.getenv("PAGE_SIZE", "50"))
+MAX_PAGE_SIZE = 500
+
+# Columns actually rendered by index.html / invoice.html (no SELECT *)
+LIST_COLUMNS = "id, product_id, name, stock, supplier, cost_price, selling_price, image_url, thumb_url"
+PICKER_COLUMNS = "id, product_id, name, stock, selling_price, image_url, thumb_url"
+INVOICE_LIST_COLUMNS = "id, customer_name, created_at, total, item_count"
+
+# ?sort=<key> -> ORDER BY expressions; `id` is always the final tie-breaker
+INVENTORY_SORTS = {
+    "id": ["id"],
+    "product_id": ["product_id", "id"],
+    "name": ["name", "id"],
+    "stock": ["stock", "id"],
+}
+
+
+class Page:
+    def __init__(self, rows, next_cursor=None, prev_cursor=None):
+        self.rows = rows
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    raise TypeError(f"Cannot encode {type(value).__name__} in a cursor")
+
+
+def encode_cursor(values):
+    raw = json.dumps(list(values), separators=(",", ":"), default=_json_default)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token, n_keys):
+    """Return the key values stored in `token`, or None if it is malformed."""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(values, list) or len(values) != n_keys:
+        return None
+    return values
+
+
+def page_size(value, default=PAGE_SIZE):
+    try:
+        return max(1, min(int(value), MAX_PAGE_SIZE))
+    except (TypeError, ValueError):
+        return default
+
+
+def keyset_page(cursor, columns, from_sql, order, where="TRUE", params=None,
+                after=None, before=None, limit=PAGE_SIZE, descending=False):
+    """Fetch one page using keyset (seek) pagination.
+
+    `order` is a list of SQL expressions that together are unique (end it with
+    the primary key). `after`/`before` are cursors taken from a previous Page.
+    Cost is O(limit) regardless of how deep the page is, unlike OFFSET.
+    """
+    params = dict(params or {})
+    keys = [f"{expr} AS _k{i}" for i, expr in enumerate(order)]
+
+    backwards = before is not None and after is None
+    values = decode_cursor(before if backwards else after, len(order))
+    if values is None:
+        backwards = False
+
+    op = ">" if descending == backwards else "<"
+    direction = "ASC" if op == ">" else "DESC"
+
+    conditions = [where]
+    if values is not None:
+        placeholders = []
+        for i, v in enumerate(values):
+            params[f"_c{i}"] = v
+            placeholders.append(f"%(_c{i})s")
+        conditions.append(f"({', '.join(order)}) {op} ({', '.join(placeholders)})")
+    params["_limit"] = limit + 1
+
+    cursor.execute(f"""
+        SELECT {columns}, {', '.join(keys)}
+        FROM {from_sql}
+        WHERE {' AND '.join(f'({c})' for c in conditions)}
+        ORDER BY {', '.join(f'{expr} {direction}' for expr in order)}
+        LIMIT %(_limit)s
+    """, params)
+    rows = cursor.fetchall()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if backwards:
+        rows.reverse()
+
+    cursors = []
+    for row in rows:
+        cursors.append(encode_cursor(row.pop(f"_k{i}") for i in range(len(order))))
+
+    if not rows:
+        return Page(rows)
+    if backwards:
+        return Page(rows, next_cursor=cursors[-1], prev_cursor=cursors[0] if has_more else None)
+    return Page(rows,
+                next_cursor=cursors[-1] if has_more else None,
+                prev_cursor=cursors[0] if values is not None else None)
+
+
+def inventory_page(cursor, sort="id", descending=False, after=None, before=None,
+                   limit=PAGE_SIZE, columns=LIST_COLUMNS):
+    order = INVENTORY_SORTS.get(sort, INVENTORY_SORTS["id"])
+    return keyset_page(cursor, columns, "inventory", order, after=after, before=before,
+                       limit=limit, descending=descending)
+
+
+def invoices_page(cursor, after=None, before=None, limit=PAGE_SIZE):
+    """Invoice headers, newest first; totals come from the maintained columns."""
+    return keyset_page(cursor, INVOICE_LIST_COLUMNS, "invoices", ["created_at", "id"],
+                       after=after, before=before, limit=limit, descending=True)
@@ -0,0 +1,159 @@
+import glob
+import os
+import re
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class PdfCache:
+    """On-disk cache of rendered invoice PDFs.
+
+    Files are named ``<invoice_id>-<version>-<build>.pdf`` where `version` is
+    the invoice's content version and `build` the app's build id (set by
+    app.py), so neither an edited invoice nor a deploy that changes the
+    layout ever serves an old file. The directory is kept under `max_bytes` by evicting the least recently
+    served files (by mtime, refreshed on every hit).
+    """
+
+    def __init__(self, directory, max_bytes=200 * 1024 * 1024, build=""):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.build = build
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def build(self):
+        return self._build
+
+    @build.setter
+    def build(self, value):
+        self._build = re.sub(r"[^0-9A-Za-z_.]", "_", str(value))  # part of a file name
+
+    def path(self, invoice_id, version):
+        return os.path.join(self.directory, f"{int(invoice_id)}-{int(version)}-{self.build}.pdf")
+
+    def get(self, invoice_id, version):
+        """Open the cached PDF for reading (binary), or None on a miss.
+
+        An open file stays readable even if another worker evicts or
+        invalidates it meanwhile, which a bare path would not.
+        """
+        path = self.path(invoice_id, version)
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        try:
+            os.utime(path)  # mark as recently used for eviction
+        except FileNotFoundError:
+            pass
+        self.hits += 1
+        return f
+
+    def put(self, invoice_id, version, data):
+        """Store `data` atomically; returns the file path (None if not stored).
+
+        Older versions of the invoice, and files of other builds, are removed.
+        A late write of an older version (e.g. a slow background pre-render)
+        is discarded instead, so it can neither replace nor outlive the newer
+        file.
+        """
+        path = self.path(invoice_id, version)
+        tmp = None
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError:
+            if tmp is not None:
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+            return None
+        self.invalidate(invoice_id, below=version)
+        if any(v > version for v, build, _ in self._files(invoice_id) if build == self.build):
+            self.invalidate(invoice_id, below=version + 1)
+            return None
+        self._evict()
+        return path
+
+    def _files(self, invoice_id):
+        """[(version, build, path)] of the cached files of an invoice (any build)."""
+        out = []
+        for path in glob.glob(os.path.join(self.directory, f"{int(invoice_id)}-*.pdf")):
+            _, version, build = (os.path.basename(path)[:-4].split("-", 2) + [""])[:3]
+            try:
+                out.append((int(version), build, path))
+            except ValueError:
+                continue
+        return out
+
+    def invalidate(self, invoice_id, below=None):
+        """Remove the invoice's cached files, or only those older than version `below` (or of another build)."""
+        for version, build, path in self._files(invoice_id):
+            if below is None or version < below or build != self.build:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def _evict(self):
+        with self._lock:
+            try:
+                entries = [e for e in os.scandir(self.directory) if e.name.endswith(".pdf")]
+            except FileNotFoundError:
+                return
+            files = []
+            for e in entries:
+                try:
+                    st = e.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((st.st_mtime, st.st_size, e.path))
+            total = sum(size for _, size, _ in files)
+            for _, size, path in sorted(files):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    self.evictions += 1
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "max_bytes": self.max_bytes}
+
+
+pdf_cache = PdfCache(
+    os.getenv("PDF_CACHE_DIR", os.path.join("cache", "pdf")),
+    max_bytes=int(float(os.getenv("PDF_CACHE_MAX_MB", "200")) * 1024 * 1024),
+)
+
+# -------------------- BACKGROUND PRE-RENDER --------------------
+PDF_PRERENDER = os.getenv("PDF_PRERENDER", "0") == "1"
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def submit_background(fn, *args):
+    """Run fn(*args) on the shared pre-render worker thread (no-op unless PDF_PRERENDER=1)."""
+    global _executor
+    if not PDF_PRERENDER:
+        return None
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=int(os.getenv("PDF_PRERENDER_WORKERS", "1")),
+                thread_name_prefix="pdf-prerender",
+            )
+    return _executor.submit(fn, *args)
@@ -0,0 +1,134 @@
+import io
+from functools import lru_cache
+
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.pdfgen import canvas
+
+
+# ✅ Fungsi bantu: format ke Rupiah
+def format_rupiah(value):
+    try:
+        value = float(value)
+        return "Rp {:,.0f}".format(value).replace(",", ".")
+    except (ValueError, TypeError):
+        return "Rp 0"
+
+
+@lru_cache(maxsize=4096)
+def _word_width(word, font_name, font_size):
+    return stringWidth(word, font_name, font_size)
+
+
+# ✅ Fungsi bantu: bungkus teks panjang
+def wrap_text(text, max_width, font_name="Helvetica", font_size=12):
+    """Word-wrap `text` to `max_width` points.
+
+    Each word is measured once (and memoised across invoices) instead of
+    re-measuring the whole growing line for every word.
+    """
+    space = _word_width(" ", font_name, font_size)
+    lines, current, current_width = [], [], 0.0
+    for word in text.split():
+        width = _word_width(word, font_name, font_size)
+        if current and current_width + space + width > max_width:
+            lines.append(" ".join(current))
+            current, current_width = [word], width
+        elif current:
+            current.append(word)
+            current_width += space + width
+        else:
+            current, current_width = [word], width
+    if current:
+        lines.append(" ".join(current))
+    return lines or [""]
+
+
+def render_invoice_pdf(invoice, items):
+    """Render one invoice (header row + item rows with `name`) to PDF bytes."""
+    buffer = io.BytesIO()
+    # invariant: no timestamps/random ids in the file, so the same invoice
+    # version always renders to the same bytes (strong ETag in app.py)
+    p = canvas.Canvas(buffer, pagesize=letter, invariant=1)
+    width, height = letter
+
+    # Margin dan posisi kolom (lebih sempit untuk produk)
+    left_margin = 70
+    right_margin = 550
+    col_qty = left_margin
+    col_product = left_margin + 60
+    col_price = left_margin + 290     # lebih dekat ke kanan
+    col_subtotal = left_margin + 400  # diperlebar agar lebih lega
+    product_col_width = 180          # lebar kolom produk dipersempit
+
+    y = height - 70
+    p.setFont("Helvetica-Bold", 16)
+    p.drawString(left_margin, y, f"Nota #{invoice['id']}")
+
+    y -= 30
+    p.setFont("Helvetica", 12)
+    p.drawString(left_margin, y, f"Nama Pelanggan : {invoice['customer_name']}")
+    y -= 20
+    p.drawString(left_margin, y, f"Tanggal : {invoice['created_at']}")
+
+    # Header tabel
+    y -= 40
+    p.setFont("Helvetica-Bold", 12)
+    p.drawString(col_qty, y, "Jumlah")
+    p.drawString(col_product, y, "Produk")
+    p.drawString(col_price + 40, y, "Harga")
+    p.drawString(col_subtotal + 20, y, "Subtotal")
+
+    y -= 10
+    p.line(left_margin, y, right_margin, y)
+    y -= 20
+
+    # Isi tabel
+    p.setFont("Helvetica", 12)
+    total = invoice["total"]
+    for item in items:
+        qty = str(item["quantity"])
+        price = format_rupiah(item["price"])
+        subtotal = format_rupiah(item["subtotal"])
+
+        # Bungkus nama produk
+        name_lines = wrap_text(item["name"], product_col_width, "Helvetica", 12)
+        line_height = 15
+
+        # Baris pertama
+        p.drawString(col_qty, y, qty)
+        p.drawString(col_product, y, name_lines[0])
+        p.drawRightString(col_price + 80, y, price)
+        p.drawRightString(right_margin, y, subtotal)
+        y -= line_height
+
+        # Baris tambahan untuk nama panjang
+        for line in name_lines[1:]:
+            p.drawString(col_product, y, line)
+            y -= line_height
+
+        # Jika halaman penuh → lanjut halaman baru
+        if y < 100:
+            p.showPage()
+            y = height - 70
+            p.setFont("Helvetica-Bold", 12)
+            p.drawString(col_qty, y, "Jumlah")
+            p.drawString(col_product, y, "Produk")
+            p.drawString(col_price + 40, y, "Harga")
+            p.drawString(col_subtotal + 20, y, "Subtotal")
+            y -= 10
+            p.line(left_margin, y, right_margin, y)
+            y -= 20
+            p.setFont("Helvetica", 12)
+
+    # Total
+    y -= 10
+    p.line(left_margin, y, right_margin, y)
+    y -= 25
+    p.setFont("Helvetica-Bold", 12)
+    p.drawRightString(col_price + 80, y, "TOTAL :")
+    p.drawRightString(right_margin, y, format_rupiah(total))
+
+    p.showPage()
+    p.save()
+    return buffer.getvalue()
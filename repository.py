@@ -0,0 +1,797 @@
+"""Inventory and invoice queries behind one interface, for PostgreSQL or SQLite.
+
+    with repo.session() as db:
+        invoice_id = db.create_invoice(customer_name, lines)
+        db.bump_version("inventory")
+        db.commit()
+
+DB_BACKEND=postgres (default) borrows pooled DATABASE_URL connections from
+db.py; DB_BACKEND=sqlite keeps the shop in one local file (repository_sqlite.py),
+with no network round trips and a hermetic database for load tests.
+
+A session behaves like get_db(): nothing is persisted until commit(), and
+whatever is left uncommitted is rolled back when the block exits. On both
+backends stock only moves through conditional updates (`stock >= qty`) inside
+that transaction, so concurrent sales can never take stock below zero and a
+failed sale changes nothing.
+"""
+import csv
+import io
+import os
+import threading
+from contextlib import contextmanager
+from datetime import date, datetime, timezone
+
+import psycopg2.extras
+
+from db import get_db, pool_stats
+from pagination import LIST_COLUMNS, PAGE_SIZE, inventory_page, invoices_page
+from schema import apply_schema
+from search import SEARCH_LIMIT, search_products
+
+DB_BACKEND = os.getenv("DB_BACKEND", "postgres")
+
+# Columns add_product() / update_product() accept
+PRODUCT_COLUMNS = ("product_id", "name", "stock", "supplier", "cost_price", "selling_price", "image_url", "thumb_url")
+
+# stock_movements.reason: sale, invoice_edit, invoice_delete (invoice_id set), add, adjust (edit form),
+# delete, import, opening (balance when the ledger started), reconcile (reconcile-stock --fix)
+MOVEMENT_COLUMNS = ("product_id", "delta", "reason", "invoice_id")
+# Open ends for the ledger queries (as timestamps both backends compare correctly)
+LEDGER_START = datetime(1970, 1, 1, tzinfo=timezone.utc)
+LEDGER_END = datetime(9999, 12, 31, tzinfo=timezone.utc)
+
+# sales_daily row: one per (day, product) with sales (analytics.py)
+SALES_COLUMNS = ("day", "product_id", "quantity", "revenue", "cost")
+
+
+class OutOfStock(Exception):
+    """Raised by sales and invoice edits when some lines exceed the stock (nothing is changed)."""
+
+    def __init__(self, errors, short_items):
+        super().__init__(" ".join(errors))
+        self.errors = errors
+        self.short_items = short_items
+
+
+class PostgresSession:
+    """The app's SQL for one borrowed connection.
+
+    Statements use psycopg2 placeholders (%s / %(name)s) and return dict rows;
+    SQLiteSession reuses every method whose SQL both databases understand and
+    overrides the rest.
+    """
+
+    backend = "postgres"
+    dialect = "postgres"
+    NOW = "now()"
+    FOR_UPDATE = " FOR UPDATE"
+    DATE_OF = "CAST({} AS DATE)"  # calendar day of a timestamp column
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def cursor(self):
+        return self.conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+
+    def in_array(self, placeholder):
+        """`<column> <in_array(...)>` is true if the column equals any id of a list parameter."""
+        return f"= ANY({placeholder})"
+
+    def begin(self):
+        """Start a write transaction (psycopg2 opens one implicitly)."""
+
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        self.conn.rollback()
+
+    # -------------------- DATA VERSIONS --------------------
+    # One counter row per table (see cache.py). Writers bump it inside their
+    # own transaction, so every worker can tell that its cached copy is stale.
+
+    def bump_version(self, name):
+        with self.cursor() as cur:
+            cur.execute(f"""
+                UPDATE data_versions SET version = version + 1, updated_at = {self.NOW}
+                WHERE name = %s RETURNING version
+            """, (name,))
+            row = cur.fetchone()
+        return row["version"] if row else None
+
+    def read_version(self, name):
+        with self.cursor() as cur:
+            cur.execute("SELECT version FROM data_versions WHERE name = %s", (name,))
+            row = cur.fetchone()
+        return row["version"] if row else 0
+
+    def version_rows(self):
+        """{name: (version, updated_at)} for the whole data_versions table."""
+        with self.cursor() as cur:
+            cur.execute("SELECT name, version, updated_at FROM data_versions")
+            return {row["name"]: (row["version"], row["updated_at"]) for row in cur.fetchall()}
+
+    # -------------------- INVENTORY --------------------
+
+    def inventory_page(self, sort="id", descending=False, after=None, before=None,
+                       limit=PAGE_SIZE, columns=LIST_COLUMNS):
+        with self.cursor() as cur:
+            return inventory_page(cur, sort=sort, descending=descending, after=after, before=before,
+                                  limit=limit, columns=columns)
+
+    def search_products(self, term, limit=SEARCH_LIMIT, columns="*", after=None, before=None):
+        with self.cursor() as cur:
+            return search_products(cur, term, limit=limit, columns=columns, after=after, before=before,
+                                   dialect=self.dialect)
+
+    def products_by_id(self, ids, columns=LIST_COLUMNS):
+        """{id: row} in one query."""
+        with self.cursor() as cur:
+            cur.execute(f"SELECT {columns} FROM inventory WHERE id {self.in_array('%s')}", (list(ids),))
+            return {row["id"]: dict(row) for row in cur.fetchall()}
+
+    def product_by_product_id(self, product_id, columns=LIST_COLUMNS):
+        with self.cursor() as cur:
+            cur.execute(f"SELECT {columns} FROM inventory WHERE product_id = %s", (product_id,))
+            row = cur.fetchone()
+        return dict(row) if row is not None else None
+
+    def get_product(self, item_id):
+        with self.cursor() as cur:
+            cur.execute("SELECT * FROM inventory WHERE id=%s", (item_id,))
+            return cur.fetchone()
+
+    def add_product(self, fields):
+        """INSERT a product from a {column: value} dict (PRODUCT_COLUMNS); returns its id."""
+        columns = [c for c in PRODUCT_COLUMNS if c in fields]
+        self.begin()
+        with self.cursor() as cur:
+            cur.execute(f"""
+                INSERT INTO inventory ({', '.join(columns)})
+                VALUES ({', '.join(f'%({c})s' for c in columns)})
+                RETURNING id
+            """, fields)
+            item_id = cur.fetchone()["id"]
+        if fields.get("stock"):
+            self.record_movements([(item_id, fields["stock"], "add", None)])
+        return item_id
+
+    def update_product(self, item_id, fields):
+        """UPDATE the given columns; returns False if the product doesn't exist."""
+        columns = [c for c in PRODUCT_COLUMNS if c in fields]
+        self.begin()
+        with self.cursor() as cur:
+            cur.execute(f"SELECT name, stock FROM inventory WHERE id=%s{self.FOR_UPDATE}", (item_id,))
+            old = cur.fetchone()
+            if old is None:
+                return False
+            cur.execute(f"UPDATE inventory SET {', '.join(f'{c}=%({c})s' for c in columns)} WHERE id=%(_id)s",
+                        {**fields, "_id": item_id})
+            if "name" in fields and old["name"] != fields["name"]:
+                # The name is printed on invoice PDFs → bump their content version
+                cur.execute("""
+                    UPDATE invoices SET version = version + 1
+                    WHERE id IN (SELECT invoice_id FROM invoice_items WHERE product_id=%s)
+                """, (item_id,))
+        if "stock" in fields and fields["stock"] != old["stock"]:
+            self.record_movements([(item_id, fields["stock"] - old["stock"], "adjust", None)])
+        return True
+
+    def delete_product(self, item_id):
+        self.begin()
+        with self.cursor() as cur:
+            cur.execute("DELETE FROM inventory WHERE id=%s RETURNING stock", (item_id,))
+            row = cur.fetchone()
+        if row and row["stock"]:
+            self.record_movements([(item_id, -row["stock"], "delete", None)])
+        return row is not None
+
+    def set_product_images(self, item_id, image_url, thumb_url, pending_url):
+        """Point the product at its variants, only if it still shows `pending_url`."""
+        self.begin()
+        with self.cursor() as cur:
+            cur.execute("""
+                UPDATE inventory SET image_url=%s, thumb_url=%s
+                WHERE id=%s AND image_url=%s
+            """, (image_url, thumb_url, item_id, pending_url))
+            return cur.rowcount > 0
+
+    def referenced_images(self):
+        with self.cursor() as cur:
+            cur.execute("""
+                SELECT image_url AS url FROM inventory WHERE image_url IS NOT NULL
+                UNION
+                SELECT thumb_url FROM inventory WHERE thumb_url IS NOT NULL
+            """)
+            return [row["url"] for row in cur.fetchall()]
+
+    # ---- bulk import (bulk_import.py) ----
+    def create_import_staging(self):
+        """Empty temporary import_staging table (IMPORT_COLUMNS) for this transaction."""
+        self.begin()
+        with self.cursor() as cur:
+            cur.execute("""
+                CREATE TEMP TABLE import_staging (
+                    line INTEGER, product_id TEXT PRIMARY KEY, name TEXT, stock INTEGER, supplier TEXT,
+                    cost_price NUMERIC, selling_price NUMERIC, old_stock INTEGER
+                ) ON COMMIT DROP
+            """)
+
+    def _upsert_sql(self, stock_mode):
+        # Blank cells are NULL in staging: 0 for new products, current value kept for existing ones
+        def staged(c):
+            return f"(SELECT s.{c} FROM import_staging s WHERE s.product_id = EXCLUDED.product_id)"
+        stock = ("inventory.stock + COALESCE({}, 0)" if stock_mode == "add" else "COALESCE({}, inventory.stock)")
+        sets = ["name = EXCLUDED.name", "stock = " + stock.format(staged("stock"))]
+        sets += [f"{c} = COALESCE({staged(c)}, inventory.{c})" for c in ("supplier", "cost_price", "selling_price")]
+        # WHERE TRUE: SQLite needs it to parse INSERT ... SELECT ... ON CONFLICT
+        return f"""
+            INSERT INTO inventory (product_id, name, stock, supplier, cost_price, selling_price)
+            SELECT product_id, name, COALESCE(stock, 0), supplier, COALESCE(cost_price, 0), COALESCE(selling_price, 0)
+            FROM import_staging WHERE TRUE
+            ON CONFLICT (product_id) DO UPDATE SET {', '.join(sets)}
+        """
+
+    def _bump_renamed_invoices(self, cur):
+        # Names are printed on invoice PDFs, as in update_product()
+        cur.execute("""
+            UPDATE invoices SET version = version + 1
+            WHERE id IN (SELECT ii.invoice_id FROM invoice_items ii
+                         JOIN inventory i ON i.id = ii.product_id
+                         JOIN import_staging s ON s.product_id = i.product_id
+                         WHERE i.name <> s.name)
+        """)
+        return cur.rowcount
+
+    def _stage_old_stock(self, cur):
+        # Lock the products the import updates and keep their stock for the ledger
+        cur.execute(f"""
+            SELECT i.id FROM inventory i JOIN import_staging s ON s.product_id = i.product_id
+            ORDER BY i.id{self.FOR_UPDATE}
+        """)
+        cur.execute("""
+            UPDATE import_staging
+            SET old_stock = (SELECT i.stock FROM inventory i WHERE i.product_id = import_staging.product_id)
+        """)
+
+    def _record_import_movements(self, cur):
+        cur.execute("""
+            INSERT INTO stock_movements (product_id, delta, reason)
+            SELECT i.id, i.stock - COALESCE(s.old_stock, 0), 'import'
+            FROM import_staging s JOIN inventory i ON i.product_id = s.product_id
+            WHERE i.stock <> COALESCE(s.old_stock, 0)
+        """)
+
+    def upsert_staged_products(self, stock_mode="set"):
+        """import_staging -> inventory, keyed on product_id; returns inserted/updated/renamed_invoices.
+
+        Existing products take every non-blank value from the file; with
+        stock_mode="add" the stock is added to theirs instead of replacing it.
+        """
+        self.begin()
+        with self.cursor() as cur:
+            renamed = self._bump_renamed_invoices(cur)
+            self._stage_old_stock(cur)
+            cur.execute(f"""
+                WITH up AS ({self._upsert_sql(stock_mode)} RETURNING (xmax = 0) AS inserted)
+                SELECT COUNT(*) FILTER (WHERE inserted) AS inserted, COUNT(*) FILTER (WHERE NOT inserted) AS updated
+                FROM up
+            """)
+            row = cur.fetchone()
+            self._record_import_movements(cur)
+        return {"inserted": row["inserted"], "updated": row["updated"], "renamed_invoices": renamed}
+
+    def set_images_by_product_id(self, rows):
+        """[(product_id, image_url, thumb_url)] in one statement."""
+        self.begin()
+        with self.cursor() as cur:
+            psycopg2.extras.execute_values(cur, """
+                UPDATE inventory AS i SET image_url = v.image_url, thumb_url = v.thumb_url
+                FROM (VALUES %s) AS v(product_id, image_url, thumb_url)
+                WHERE i.product_id = v.product_id
+            """, rows, page_size=1000)
+
+    # -------------------- STOCK --------------------
+
+    def _take_stock(self, requested):
+        """Decrease stock by {product id: qty} where enough is left; returns the ids that were updated."""
+        with self.cursor() as cur:
+            # One set-based statement for every line
+            updated = psycopg2.extras.execute_values(cur, """
+                UPDATE inventory AS inv
+                SET stock = inv.stock - req.qty
+                FROM (VALUES %s) AS req(id, qty)
+                WHERE inv.id = req.id AND inv.stock >= req.qty
+                RETURNING inv.id
+            """, list(requested.items()), template="(%s::int, %s::int)",
+                page_size=len(requested), fetch=True)
+        return {row["id"] for row in updated}
+
+    def _stock_of(self, ids):
+        with self.cursor() as cur:
+            cur.execute(f"SELECT id, name, stock FROM inventory WHERE id {self.in_array('%s')}", (list(ids),))
+            return {row["id"]: row for row in cur.fetchall()}
+
+    # -------------------- STOCK LEDGER --------------------
+    # Every stock change appends to stock_movements in its own transaction.
+    # stock_snapshots holds per-product balances at snapshot times, so a
+    # balance at any moment is the last snapshot before it plus the movements
+    # since (cost grows with the movements after the snapshot, not the history).
+
+    def record_movements(self, movements):
+        """Append [(product id, delta, reason, invoice id)] to the ledger; zero deltas are skipped."""
+        rows = [m for m in movements if m[1]]
+        if rows:
+            self.insert_many("stock_movements", MOVEMENT_COLUMNS, rows)
+
+    def _ledger_sql(self, where):
+        return f"""
+            SELECT i.id, i.product_id, i.name, i.stock,
+                   COALESCE(s.stock, 0) + COALESCE((
+                       SELECT SUM(m.delta) FROM stock_movements m
+                       WHERE m.product_id = i.id
+                         AND m.moved_at > COALESCE(s.taken_at, %(start)s) AND m.moved_at <= %(at)s
+                   ), 0) AS ledger_stock
+            FROM inventory i
+            LEFT JOIN stock_snapshots s ON s.product_id = i.id AND s.taken_at = (
+                SELECT MAX(taken_at) FROM stock_snapshots WHERE product_id = i.id AND taken_at <= %(at)s
+            )
+            WHERE {where}
+            ORDER BY i.id
+        """
+
+    def stock_at(self, ids, at):
+        """{id: stock at `at`} for the given products, from the ledger."""
+        with self.cursor() as cur:
+            cur.execute(self._ledger_sql(f"i.id {self.in_array('%(ids)s')}"),
+                        {"ids": list(ids), "at": at, "start": LEDGER_START})
+            return {row["id"]: row["ledger_stock"] for row in cur.fetchall()}
+
+    def ledger_page(self, after_id=0, limit=5000, at=LEDGER_END):
+        """Keyset page of products: inventory.stock next to the ledger balance at `at` (one read)."""
+        with self.cursor() as cur:
+            cur.execute(self._ledger_sql("i.id > %(after)s") + " LIMIT %(limit)s",
+                        {"after": after_id, "limit": limit, "at": at, "start": LEDGER_START})
+            return cur.fetchall()
+
+    def product_movements(self, item_id, limit=50):
+        with self.cursor() as cur:
+            cur.execute("""
+                SELECT id, delta, reason, invoice_id, moved_at FROM stock_movements
+                WHERE product_id = %s ORDER BY moved_at DESC, id DESC LIMIT %s
+            """, (item_id, limit))
+            return cur.fetchall()
+
+    def _lock_snapshots(self, cur):
+        # One snapshot run at a time; readers are not blocked
+        cur.execute("LOCK TABLE stock_snapshots IN SHARE ROW EXCLUSIVE MODE")
+
+    def take_stock_snapshot(self, cutoff):
+        """Snapshot, as of `cutoff`, every product that moved since the last run; returns the row count.
+
+        Returns None (and writes nothing) unless `cutoff` is after the last snapshot.
+        """
+        self.begin()
+        with self.cursor() as cur:
+            self._lock_snapshots(cur)
+            cur.execute("SELECT MAX(taken_at) AS taken_at FROM stock_snapshots")
+            last = cur.fetchone()["taken_at"]
+            if last is not None and last >= cutoff:
+                return None
+            # Products without movements since `last` keep their previous snapshot
+            cur.execute("""
+                INSERT INTO stock_snapshots (product_id, taken_at, stock)
+                SELECT m.product_id, %(cutoff)s,
+                       COALESCE((SELECT s.stock FROM stock_snapshots s WHERE s.product_id = m.product_id
+                                 ORDER BY s.taken_at DESC LIMIT 1), 0) + SUM(m.delta)
+                FROM stock_movements m
+                WHERE m.moved_at > %(since)s AND m.moved_at <= %(cutoff)s
+                GROUP BY m.product_id
+            """, {"cutoff": cutoff, "since": last or LEDGER_START})
+            return cur.rowcount
+
+    # -------------------- INVOICES --------------------
+
+    def create_invoice(self, customer_name, lines):
+        """Sell `lines` [(product id, qty, price, subtotal)]; returns the new invoice id.
+
+        Raises OutOfStock listing every short item (not just the first one).
+        """
+        requested = {}  # product id -> total qty (same product may appear twice)
+        for product_id, qty, _, _ in lines:
+            requested[product_id] = requested.get(product_id, 0) + qty
+
+        self.begin()
+        done = self._take_stock(requested)
+        if len(done) < len(requested):
+            short_ids = [pid for pid in requested if pid not in done]
+            found = self._stock_of(short_ids)
+            self.rollback()
+            errors, short_items = [], []
+            for pid in short_ids:
+                p = found.get(pid)
+                if not p:
+                    errors.append(f"Product not found (id: {pid}).")
+                    short_items.append({"id": pid, "requested": requested[pid], "stock": None})
+                else:
+                    errors.append(f"Not enough stock for {p['name']} (Stock: {p['stock']}).")
+                    short_items.append({"id": pid, "name": p["name"], "requested": requested[pid],
+                                        "stock": p["stock"]})
+            raise OutOfStock(errors, short_items)
+
+        # Header with its precomputed total, then all lines in one multi-row INSERT
+        total = round(sum(line[3] for line in lines), 2)
+        with self.cursor() as cur:
+            cur.execute(
+                "INSERT INTO invoices (customer_name, total, item_count) VALUES (%s, %s, %s) RETURNING id",
+                (customer_name, total, len(lines))
+            )
+            invoice_id = cur.fetchone()["id"]
+        self.insert_many("invoice_items", ("invoice_id", "product_id", "quantity", "price", "subtotal"),
+                         [(invoice_id, *line) for line in lines])
+        self.record_movements([(pid, -qty, "sale", invoice_id) for pid, qty in requested.items()])
+        self.mark_sales_dirty([invoice_id])
+        return invoice_id
+
+    def invoices_page(self, after=None, before=None, limit=PAGE_SIZE):
+        with self.cursor() as cur:
+            return invoices_page(cur, after=after, before=before, limit=limit)
+
+    def get_invoice(self, invoice_id):
+        with self.cursor() as cur:
+            cur.execute("SELECT * FROM invoices WHERE id=%s", (invoice_id,))
+            return cur.fetchone()
+
+    def invoice_head(self, invoice_id):
+        """{id, version} of an invoice (for the PDF cache), or None."""
+        with self.cursor() as cur:
+            cur.execute("SELECT id, version FROM invoices WHERE id=%s", (invoice_id,))
+            return cur.fetchone()
+
+    def invoice_items(self, invoice_id):
+        with self.cursor() as cur:
+            cur.execute("SELECT * FROM invoice_items WHERE invoice_id=%s ORDER BY id", (invoice_id,))
+            return cur.fetchall()
+
+    def invoice_for_pdf(self, invoice_id):
+        """(invoice, items with product name/image); customer_name is still encrypted."""
+        invoice = self.get_invoice(invoice_id)
+        with self.cursor() as cur:
+            cur.execute("""
+                SELECT ii.*, inv.name, inv.image_url
+                FROM invoice_items ii
+                JOIN inventory inv ON ii.product_id = inv.id
+                WHERE ii.invoice_id=%s
+                ORDER BY ii.id
+            """, (invoice_id,))
+            return invoice, cur.fetchall()
+
+    def delete_invoice(self, invoice_id):
+        """Delete the invoice and put its items back into stock."""
+        self.begin()
+        self.mark_sales_dirty([invoice_id])
+        with self.cursor() as cur:
+            # Both parts see the same snapshot, so the UPDATE still reads the lines
+            # that the (cascading) DELETE removes.
+            cur.execute("""
+                WITH restored AS (
+                    UPDATE inventory AS inv
+                    SET stock = inv.stock + it.qty
+                    FROM (
+                        SELECT product_id, SUM(quantity) AS qty
+                        FROM invoice_items
+                        WHERE invoice_id = %(id)s
+                        GROUP BY product_id
+                    ) AS it
+                    WHERE inv.id = it.product_id
+                    RETURNING inv.id, it.qty
+                ),
+                logged AS (
+                    INSERT INTO stock_movements (product_id, delta, reason, invoice_id)
+                    SELECT id, qty, 'invoice_delete', %(id)s FROM restored
+                )
+                DELETE FROM invoices WHERE id = %(id)s
+            """, {"id": invoice_id})
+            return cur.rowcount > 0
+
+    def edit_invoice(self, invoice_id, customer_name, item_ids, quantities, prices):
+        """Apply the edit form: new quantities/prices for kept lines, missing lines removed.
+
+        Returns None if the invoice doesn't exist, "deleted" if no line is
+        left (the invoice is removed) and "updated" otherwise. Stock follows
+        the quantity changes; raises OutOfStock if an increase doesn't fit.
+        Raises ValueError if `item_ids` repeats a line: it would be counted
+        twice in the stock delta but updated only once.
+        """
+        if len(set(item_ids)) != len(item_ids):
+            raise ValueError("Duplicate invoice line id.")
+        self.begin()
+        with self.cursor() as cur:
+            # Update customer name and content version (also locks the header,
+            # serialising edits of this invoice)
+            cur.execute("UPDATE invoices SET customer_name=%s, version = version + 1 WHERE id=%s RETURNING id",
+                        (customer_name, invoice_id))
+            if cur.fetchone() is None:
+                return None
+            self.mark_sales_dirty([invoice_id])
+
+            # 1) Quantity delta per product: stored lines vs submitted form.
+            #    Lines missing from the form count as quantity 0 (removed).
+            cur.execute("""
+                SELECT ii.product_id,
+                       SUM(COALESCE(sub.quantity, 0) - ii.quantity) AS delta,
+                       COUNT(sub.item_id) AS kept
+                FROM invoice_items ii
+                LEFT JOIN unnest(%s::int[], %s::int[]) AS sub(item_id, quantity)
+                       ON sub.item_id = ii.id
+                WHERE ii.invoice_id = %s
+                GROUP BY ii.product_id
+            """, (item_ids, quantities, invoice_id))
+            deltas = cur.fetchall()
+            kept = sum(row["kept"] for row in deltas)
+            changes = {row["product_id"]: int(row["delta"]) for row in deltas if row["delta"]}
+
+            # 2) Apply all stock changes in one statement (negative delta = stock returned, always passes)
+            if changes:
+                cur.execute("""
+                    UPDATE inventory AS inv
+                    SET stock = inv.stock - d.delta
+                    FROM unnest(%s::int[], %s::int[]) AS d(product_id, delta)
+                    WHERE inv.id = d.product_id AND inv.stock >= d.delta
+                    RETURNING inv.id
+                """, (list(changes), list(changes.values())))
+                self._check_deltas(changes, {row["id"] for row in cur.fetchall()})
+                self.record_movements([(pid, -delta, "invoice_edit", invoice_id) for pid, delta in changes.items()])
+
+            # Delete entire invoice if empty
+            if kept == 0:
+                cur.execute("DELETE FROM invoices WHERE id=%s", (invoice_id,))
+                return "deleted"
+
+            # 3) Update kept lines and delete removed ones in one statement
+            cur.execute("""
+                WITH sub AS (
+                    SELECT * FROM unnest(%(ids)s::int[], %(qtys)s::int[], %(prices)s::numeric[])
+                        AS s(item_id, quantity, price)
+                ),
+                updated AS (
+                    UPDATE invoice_items AS ii
+                    SET quantity = sub.quantity, price = sub.price, subtotal = sub.quantity * sub.price
+                    FROM sub
+                    WHERE ii.id = sub.item_id AND ii.invoice_id = %(invoice_id)s
+                    RETURNING ii.id
+                )
+                DELETE FROM invoice_items
+                WHERE invoice_id = %(invoice_id)s AND id <> ALL(%(ids)s::int[])
+            """, {"ids": item_ids, "qtys": quantities, "prices": prices, "invoice_id": invoice_id})
+        self._refresh_total(invoice_id)
+        return "updated"
+
+    def _check_deltas(self, changes, done):
+        """Raise OutOfStock for increases (delta > 0) that were not applied."""
+        short_ids = [pid for pid, delta in changes.items() if delta > 0 and pid not in done]
+        if not short_ids:
+            return
+        found = self._stock_of(short_ids)
+        self.rollback()
+        errors = [
+            f"Not enough stock for {found[pid]['name']} (Stock: {found[pid]['stock']})."
+            if pid in found else f"Not enough stock for product ID {pid}."
+            for pid in short_ids
+        ]
+        raise OutOfStock(errors, [{"id": pid, "stock": found[pid]["stock"] if pid in found else None}
+                                  for pid in short_ids])
+
+    def _refresh_total(self, invoice_id):
+        """Recompute the precomputed header total (only this invoice's lines)."""
+        with self.cursor() as cur:
+            cur.execute("""
+                UPDATE invoices
+                SET total = (SELECT COALESCE(SUM(subtotal), 0) FROM invoice_items WHERE invoice_id = %(id)s),
+                    item_count = (SELECT COUNT(*) FROM invoice_items WHERE invoice_id = %(id)s)
+                WHERE id = %(id)s
+            """, {"id": invoice_id})
+
+    # ---- field key rotation (rotate-field-keys) ----
+    def customer_names_to_rotate(self, after_id, active_prefix, limit):
+        """[(id, customer_name)] not written with `active_prefix` (the current scheme/key)."""
+        with self.cursor() as cur:
+            cur.execute("""
+                SELECT id, customer_name FROM invoices
+                WHERE id > %s AND customer_name IS NOT NULL AND customer_name NOT LIKE %s ESCAPE '\\'
+                ORDER BY id
+                LIMIT %s
+            """, (after_id, active_prefix.replace("_", r"\_") + "%", limit))
+            return [(row["id"], row["customer_name"]) for row in cur.fetchall()]
+
+    def update_customer_names(self, pairs):
+        """Set customer_name for [(id, value)] in one statement."""
+        self.begin()
+        with self.cursor() as cur:
+            psycopg2.extras.execute_values(cur, """
+                UPDATE invoices AS i SET customer_name = v.name
+                FROM (VALUES %s) AS v(id, name)
+                WHERE i.id = v.id
+            """, pairs, page_size=max(1, len(pairs)))
+
+    # -------------------- SALES ROLLUPS --------------------
+    # sales_daily holds quantity / revenue / cost per (day, product). Invoice
+    # writers only mark the invoice's day in sales_dirty_days (same
+    # transaction); analytics.refresh() re-aggregates those days from the lines.
+
+    def mark_sales_dirty(self, invoice_ids):
+        """Queue the days of these invoices for re-aggregation (before they are deleted).
+
+        DO UPDATE (not DO NOTHING) also when the day is queued already: the
+        writer then holds that row's lock until it commits, so a concurrent
+        take_dirty_sales_days() waits and reads the lines after this change.
+        """
+        with self.cursor() as cur:
+            cur.execute(f"""
+                INSERT INTO sales_dirty_days (day)
+                SELECT DISTINCT {self.DATE_OF.format('created_at')} FROM invoices WHERE id {self.in_array('%s')}
+                ON CONFLICT (day) DO UPDATE SET day = EXCLUDED.day
+            """, (list(invoice_ids),))
+
+    def mark_all_sales_dirty(self):
+        """Queue every day that has invoices (rollup-sales --rebuild); returns the day count."""
+        self.begin()
+        with self.cursor() as cur:
+            cur.execute(f"""
+                INSERT INTO sales_dirty_days (day)
+                SELECT DISTINCT {self.DATE_OF.format('created_at')} FROM invoices WHERE TRUE
+                ON CONFLICT (day) DO NOTHING
+            """)
+            cur.execute("SELECT COUNT(*) AS n FROM sales_dirty_days")
+            return cur.fetchone()["n"]
+
+    def take_dirty_sales_days(self, limit):
+        """Dequeue up to `limit` dirty days, oldest first; commit together with their new rollups.
+
+        No invoice change is missed on Postgres: a writer that marked a day
+        before this DELETE holds the row lock (mark_sales_dirty), so the DELETE
+        waits for its commit and the lines read afterwards include it; a
+        writer marking a day after it waits on the deleted key and queues the
+        day again once this transaction commits. SQLite serialises writers.
+        """
+        self.begin()
+        with self.cursor() as cur:
+            cur.execute("""
+                DELETE FROM sales_dirty_days
+                WHERE day IN (SELECT day FROM sales_dirty_days ORDER BY day LIMIT %s)
+                RETURNING day
+            """, (limit,))
+            return sorted(date.fromisoformat(str(row["day"])) for row in cur.fetchall())
+
+    def dirty_sales_days(self):
+        with self.cursor() as cur:
+            cur.execute("SELECT COUNT(*) AS n FROM sales_dirty_days")
+            return cur.fetchone()["n"]
+
+    def sales_lines(self, start, end, itersize):
+        """Batches of (day, product id, quantity, subtotal, cost_price) of invoices created in [start, end)."""
+        return self.fetch_batches(f"""
+            SELECT {self.DATE_OF.format('i.created_at')} AS day, ii.product_id, ii.quantity, ii.subtotal,
+                   inv.cost_price
+            FROM invoices i
+            JOIN invoice_items ii ON ii.invoice_id = i.id
+            JOIN inventory inv ON inv.id = ii.product_id
+            WHERE i.created_at >= %(start)s AND i.created_at < %(end)s
+        """, {"start": start, "end": end}, itersize)
+
+    def replace_sales_rollups(self, days, rows):
+        """Swap the rollups of `days` for `rows` [(day, product id, quantity, revenue, cost)].
+
+        Returns the new "sales" data version (bumped in the same transaction).
+        """
+        self.begin()
+        with self.cursor() as cur:
+            cur.execute(f"DELETE FROM sales_daily WHERE day {self.in_array('%s')}", (list(days),))
+        if rows:
+            self.insert_many("sales_daily", SALES_COLUMNS, rows)
+        return self.bump_version("sales")
+
+    def sales_rollups(self, start, end, itersize):
+        """Batches of sales_daily rows (SALES_COLUMNS) for start <= day <= end."""
+        return self.fetch_batches(f"""
+            SELECT {', '.join(SALES_COLUMNS)} FROM sales_daily WHERE day >= %s AND day <= %s
+        """, (start, end), itersize)
+
+    def catalog_rows(self, itersize):
+        """Batches of (id, product_id, name, supplier, stock, cost_price) for every product, by id."""
+        return self.fetch_batches(
+            "SELECT id, product_id, name, supplier, stock, cost_price FROM inventory ORDER BY id", None, itersize)
+
+    # -------------------- BULK --------------------
+
+    def insert_many(self, table, columns, rows, returning=None, page_size=1000):
+        """Multi-row INSERT; returns the `returning` column of every row (input order) if given."""
+        self.begin()
+        sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES %s"
+        if returning:
+            sql += f" RETURNING {returning}"
+        with self.cursor() as cur:
+            out = psycopg2.extras.execute_values(cur, sql, rows, page_size=page_size, fetch=bool(returning))
+        return [row[returning] for row in out] if returning else None
+
+    def copy_rows(self, table, columns, rows, chunk_rows=50_000):
+        """Fastest bulk load there is (COPY ... FROM STDIN), in chunks; returns the row count."""
+        self.begin()
+        n = 0
+        with self.conn.cursor() as cur:
+            rows = iter(rows)
+            while True:
+                buf = io.StringIO()
+                writer = csv.writer(buf)
+                chunk = 0
+                for row in rows:
+                    writer.writerow(["\\N" if v is None else v for v in row])
+                    chunk += 1
+                    if chunk == chunk_rows:
+                        break
+                if not chunk:
+                    break
+                buf.seek(0)
+                cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')", buf)
+                n += chunk
+        return n
+
+    def stream(self, sql, params=None, itersize=2000):
+        """Yield lists of row tuples through a server-side cursor (memory stays flat)."""
+        with self.conn.cursor(name="stream") as cur:
+            cur.itersize = itersize
+            cur.execute(sql, params)
+            while True:
+                rows = cur.fetchmany(itersize)
+                if not rows:
+                    break
+                yield rows
+        self.conn.commit()  # close the read transaction the named cursor ran in
+
+    def fetch_batches(self, sql, params=None, itersize=2000):
+        """Like stream(), but inside the current transaction (the result is buffered client-side)."""
+        with self.conn.cursor() as cur:
+            cur.execute(sql, params)
+            while True:
+                rows = cur.fetchmany(itersize)
+                if not rows:
+                    break
+                yield rows
+
+
+class PostgresRepository:
+    backend = "postgres"
+
+    @contextmanager
+    def session(self):
+        with get_db() as conn:
+            yield PostgresSession(conn)
+
+    def apply_schema(self):
+        with get_db() as conn:
+            return apply_schema(conn)
+
+    def stats(self):
+        return {"backend": self.backend, **pool_stats()}
+
+
+_repository = None
+_repository_lock = threading.Lock()
+
+
+def get_repository():
+    """The process-wide repository for DB_BACKEND (postgres | sqlite)."""
+    global _repository
+    if _repository is not None:
+        return _repository
+    with _repository_lock:
+        if _repository is None:
+            if DB_BACKEND == "sqlite":
+                from repository_sqlite import SQLiteRepository
+                _repository = SQLiteRepository()
+            elif DB_BACKEND == "postgres":
+                _repository = PostgresRepository()
+            else:
+                raise RuntimeError(f"Unknown DB_BACKEND: {DB_BACKEND} (postgres or sqlite)")
+    return _repository
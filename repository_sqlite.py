@@ -0,0 +1,389 @@
+"""Embedded SQLite backend for repository.py (DB_BACKEND=sqlite).
+
+The whole shop lives in SQLITE_PATH, opened in WAL mode: readers never block
+the writer, and every gunicorn worker sees a commit as soon as it happens.
+Write transactions start with BEGIN IMMEDIATE, so the write lock is taken
+before any stock is checked and two sales of the last item queue up instead
+of failing at commit. The schema (schema.SQLITE_STATEMENTS) is created on
+first use.
+
+Sessions speak the same psycopg2-style SQL as PostgresSession: placeholders
+are translated, list parameters become JSON arrays (for json_each), and
+created_at / updated_at come back as datetimes.
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from functools import lru_cache
+
+import instrumentation
+from repository import PostgresSession
+from schema import apply_sqlite_schema
+
+SQLITE_PATH = os.getenv("SQLITE_PATH", os.path.join("data", "inventory.sqlite3"))
+SQLITE_CACHE_MB = int(os.getenv("SQLITE_CACHE_MB", "64"))
+SQLITE_MMAP_MB = int(os.getenv("SQLITE_MMAP_MB", "256"))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+DB_TIMING = os.getenv("DB_TIMING", "1") == "1"
+
+PRAGMAS = [
+    "PRAGMA journal_mode = WAL",
+    # NORMAL is crash-safe in WAL mode; only the last commits can be lost on power failure
+    f"PRAGMA synchronous = {SQLITE_SYNCHRONOUS}",
+    "PRAGMA foreign_keys = ON",
+    f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}",
+    f"PRAGMA cache_size = -{SQLITE_CACHE_MB * 1024}",  # negative = KiB
+    f"PRAGMA mmap_size = {SQLITE_MMAP_MB * 1024 * 1024}",
+    "PRAGMA temp_store = MEMORY",
+]
+
+# column name -> tzinfo of the stored text (created_at is local time, like Postgres' TIMESTAMP)
+TIMESTAMP_COLUMNS = {"created_at": None, "updated_at": timezone.utc, "moved_at": timezone.utc,
+                     "taken_at": timezone.utc}
+
+_PLACEHOLDER = re.compile(r"%\((\w+)\)s|%s|%%")
+
+
+@lru_cache(maxsize=1024)
+def translate(sql):
+    """psycopg2 placeholders -> sqlite3 ones: %(name)s -> :name, %s -> ?, %% -> %."""
+    def repl(m):
+        if m.group(1):
+            return ":" + m.group(1)
+        return "?" if m.group(0) == "%s" else "%"
+    return _PLACEHOLDER.sub(repl, sql)
+
+
+def _adapt(value):
+    if isinstance(value, (list, tuple)):
+        return json.dumps([_adapt(v) for v in value])
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            # UTC text like NOW / the *_at defaults, so comparisons are plain string order
+            return value.astimezone(timezone.utc).replace(tzinfo=None).isoformat(" ", "milliseconds")
+        return value.isoformat(" ")
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def _params(vars):
+    if vars is None:
+        return ()
+    if isinstance(vars, dict):
+        return {k: _adapt(v) for k, v in vars.items()}
+    return [_adapt(v) for v in vars]
+
+
+def _dict_row(cursor, row):
+    out = {d[0]: v for d, v in zip(cursor.description, row)}
+    for name, tz in TIMESTAMP_COLUMNS.items():
+        value = out.get(name)
+        if isinstance(value, str):
+            out[name] = datetime.fromisoformat(value).replace(tzinfo=tz)
+    return out
+
+
+class SQLiteCursor:
+    """sqlite3 cursor with the psycopg2 surface the sessions use (dict rows, %s placeholders)."""
+
+    query = None  # instrumentation logs the statement text itself
+
+    def __init__(self, conn):
+        self._cur = conn.cursor()
+        self._cur.row_factory = _dict_row
+
+    @property
+    def rowcount(self):
+        return self._cur.rowcount
+
+    @property
+    def description(self):
+        return self._cur.description
+
+    def execute(self, query, vars=None):
+        t0 = time.perf_counter()
+        try:
+            self._cur.execute(translate(query), _params(vars))
+        finally:
+            if DB_TIMING:
+                instrumentation.observe_query(self, query, time.perf_counter() - t0)
+        return self
+
+    def executemany(self, query, vars_list):
+        t0 = time.perf_counter()
+        try:
+            self._cur.executemany(translate(query), (_params(v) for v in vars_list))
+        finally:
+            if DB_TIMING:
+                instrumentation.observe_query(self, query, time.perf_counter() - t0)
+        return self
+
+    def fetchone(self):
+        return self._cur.fetchone()
+
+    def fetchmany(self, size):
+        return self._cur.fetchmany(size)
+
+    def fetchall(self):
+        return self._cur.fetchall()
+
+    def close(self):
+        self._cur.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SQLiteSession(PostgresSession):
+    backend = "sqlite"
+    dialect = "sqlite"
+    NOW = "strftime('%%Y-%%m-%%d %%H:%%M:%%f', 'now')"
+    FOR_UPDATE = ""  # BEGIN IMMEDIATE already holds the write lock
+    DATE_OF = "date({})"
+
+    def cursor(self):
+        return SQLiteCursor(self.conn)
+
+    def in_array(self, placeholder):
+        return f"IN (SELECT value FROM json_each({placeholder}))"
+
+    def begin(self):
+        if not self.conn.in_transaction:
+            self.conn.execute("BEGIN IMMEDIATE")
+
+    # ---- bulk import ----
+    def create_import_staging(self):
+        self.begin()
+        with self.cursor() as cur:
+            # Temp tables outlive the transaction here (no ON COMMIT DROP), and connections are reused
+            cur.execute("DROP TABLE IF EXISTS temp.import_staging")
+            cur.execute("""
+                CREATE TEMP TABLE import_staging (
+                    line INTEGER, product_id TEXT PRIMARY KEY, name TEXT, stock INTEGER, supplier TEXT,
+                    cost_price NUMERIC, selling_price NUMERIC, old_stock INTEGER
+                )
+            """)
+
+    def upsert_staged_products(self, stock_mode="set"):
+        self.begin()
+        with self.cursor() as cur:
+            renamed = self._bump_renamed_invoices(cur)
+            self._stage_old_stock(cur)
+            # No xmax here; BEGIN IMMEDIATE keeps this count exact until the upsert
+            cur.execute("SELECT COUNT(*) AS n FROM import_staging s JOIN inventory i ON i.product_id = s.product_id")
+            existing = cur.fetchone()["n"]
+            cur.execute(self._upsert_sql(stock_mode))
+            total = cur.rowcount
+            self._record_import_movements(cur)
+            cur.execute("DROP TABLE temp.import_staging")
+        return {"inserted": total - existing, "updated": existing, "renamed_invoices": renamed}
+
+    def set_images_by_product_id(self, rows):
+        self.begin()
+        with self.cursor() as cur:
+            cur.executemany("UPDATE inventory SET image_url = %s, thumb_url = %s WHERE product_id = %s",
+                            [(image_url, thumb_url, product_id) for product_id, image_url, thumb_url in rows])
+
+    # ---- stock ledger ----
+    def _lock_snapshots(self, cur):
+        pass  # BEGIN IMMEDIATE already serialises snapshot runs
+
+    # ---- stock ----
+    # No round trips in-process, so a statement per product costs microseconds
+    def _take_stock(self, requested):
+        done = set()
+        with self.cursor() as cur:
+            for product_id, qty in requested.items():
+                cur.execute("UPDATE inventory SET stock = stock - %s WHERE id = %s AND stock >= %s",
+                            (qty, product_id, qty))
+                if cur.rowcount:
+                    done.add(product_id)
+        return done
+
+    # ---- invoices ----
+    def delete_invoice(self, invoice_id):
+        self.begin()
+        self.mark_sales_dirty([invoice_id])
+        with self.cursor() as cur:
+            cur.execute("""
+                UPDATE inventory
+                SET stock = stock + (SELECT SUM(quantity) FROM invoice_items
+                                     WHERE invoice_id = %(id)s AND product_id = inventory.id)
+                WHERE id IN (SELECT product_id FROM invoice_items WHERE invoice_id = %(id)s)
+            """, {"id": invoice_id})
+            cur.execute("""
+                INSERT INTO stock_movements (product_id, delta, reason, invoice_id)
+                SELECT product_id, SUM(quantity), 'invoice_delete', invoice_id
+                FROM invoice_items WHERE invoice_id = %s
+                GROUP BY product_id, invoice_id
+            """, (invoice_id,))
+            cur.execute("DELETE FROM invoices WHERE id = %s", (invoice_id,))  # lines cascade
+            return cur.rowcount > 0
+
+    def edit_invoice(self, invoice_id, customer_name, item_ids, quantities, prices):
+        if len(set(item_ids)) != len(item_ids):
+            raise ValueError("Duplicate invoice line id.")
+        self.begin()
+        with self.cursor() as cur:
+            cur.execute("UPDATE invoices SET customer_name=%s, version = version + 1 WHERE id=%s",
+                        (customer_name, invoice_id))
+            if cur.rowcount == 0:
+                return None
+            self.mark_sales_dirty([invoice_id])
+
+            # Quantity delta per product: stored lines vs submitted form (missing = removed)
+            submitted = dict(zip(item_ids, quantities))
+            cur.execute("SELECT id, product_id, quantity FROM invoice_items WHERE invoice_id=%s", (invoice_id,))
+            changes, kept = {}, 0
+            for line in cur.fetchall():
+                kept += line["id"] in submitted
+                delta = submitted.get(line["id"], 0) - line["quantity"]
+                changes[line["product_id"]] = changes.get(line["product_id"], 0) + delta
+            changes = {pid: delta for pid, delta in changes.items() if delta}
+
+            done = set()
+            for product_id, delta in changes.items():
+                cur.execute("UPDATE inventory SET stock = stock - %s WHERE id = %s AND stock >= %s",
+                            (delta, product_id, delta))
+                if cur.rowcount:
+                    done.add(product_id)
+            self._check_deltas(changes, done)
+            self.record_movements([(pid, -delta, "invoice_edit", invoice_id) for pid, delta in changes.items()])
+
+            if kept == 0:
+                cur.execute("DELETE FROM invoices WHERE id=%s", (invoice_id,))
+                return "deleted"
+
+            cur.executemany("""
+                UPDATE invoice_items SET quantity = %s, price = %s, subtotal = %s
+                WHERE id = %s AND invoice_id = %s
+            """, [(q, p, q * p, item_id, invoice_id) for item_id, q, p in zip(item_ids, quantities, prices)])
+            cur.execute(f"""
+                DELETE FROM invoice_items
+                WHERE invoice_id = %s AND id NOT {self.in_array('%s')}
+            """, (invoice_id, list(item_ids)))
+        self._refresh_total(invoice_id)
+        return "updated"
+
+    def update_customer_names(self, pairs):
+        self.begin()
+        with self.cursor() as cur:
+            cur.executemany("UPDATE invoices SET customer_name = %s WHERE id = %s", [(v, i) for i, v in pairs])
+
+    # ---- bulk ----
+    def insert_many(self, table, columns, rows, returning=None, page_size=1000):
+        self.begin()
+        sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})"
+        with self.cursor() as cur:
+            if not returning:
+                cur.executemany(sql, rows)
+                return None
+            out = []
+            for row in rows:
+                cur.execute(f"{sql} RETURNING {returning}", row)
+                out.append(cur.fetchone()[returning])
+            return out
+
+    def copy_rows(self, table, columns, rows, chunk_rows=50_000):
+        self.begin()
+        sql = translate(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})")
+        before = self.conn.total_changes
+        self.conn.executemany(sql, (_params(row) for row in rows))
+        return self.conn.total_changes - before
+
+    def stream(self, sql, params=None, itersize=2000):
+        with self.cursor() as cur:
+            cur.execute(sql, params)
+            while True:
+                rows = cur.fetchmany(itersize)
+                if not rows:
+                    break
+                yield [tuple(row.values()) for row in rows]
+
+    fetch_batches = stream  # never leaves the transaction anyway
+
+
+class SQLiteRepository:
+    """Hands out SQLite connections, one per session, reusing idle ones."""
+
+    backend = "sqlite"
+
+    def __init__(self, path=SQLITE_PATH, max_idle=8):
+        if sqlite3.sqlite_version_info < (3, 35, 0):
+            raise RuntimeError(f"DB_BACKEND=sqlite needs SQLite 3.35+ (found {sqlite3.sqlite_version})")
+        self.path = path
+        self.max_idle = max_idle
+        self._idle = []
+        self._pid = None
+        self._lock = threading.Lock()
+        self._schema_ready = False
+        self._stats = {"created": 0, "checkouts": 0, "in_use": 0}
+
+    def _connect(self):
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # isolation_level=None: no implicit BEGIN; sessions open write transactions themselves
+        conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False,
+                               timeout=SQLITE_BUSY_TIMEOUT_MS / 1000)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        if not self._schema_ready:
+            apply_sqlite_schema(conn)
+            self._schema_ready = True
+        self._stats["created"] += 1
+        return conn
+
+    def _checkout(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # Forked: connections must not cross processes
+                self._idle, self._pid = [], os.getpid()
+            self._stats["checkouts"] += 1
+            self._stats["in_use"] += 1
+            if self._idle:
+                return self._idle.pop()
+            return self._connect()
+
+    def _checkin(self, conn, broken=False):
+        with self._lock:
+            self._stats["in_use"] -= 1
+            if not broken and len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    @contextmanager
+    def session(self):
+        conn = self._checkout()
+        broken = False
+        try:
+            yield SQLiteSession(conn)
+        finally:
+            try:
+                if conn.in_transaction:
+                    conn.rollback()
+            except sqlite3.Error:
+                broken = True
+            self._checkin(conn, broken)
+
+    def apply_schema(self):
+        with self.session() as db:
+            return apply_sqlite_schema(db.conn)
+
+    def stats(self):
+        with self._lock:
+            return {"backend": self.backend, "path": self.path, **self._stats,
+                    "idle": len(self._idle), "size": len(self._idle) + self._stats["in_use"]}
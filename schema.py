@@ -0,0 +1,233 @@
+"""Idempotent DDL the app relies on on top of the base tables.
+
+Apply with ``flask --app app init-db`` (safe to run repeatedly). The SQLite
+backend (repository_sqlite.py) has no pre-existing database, so
+SQLITE_STATEMENTS creates the base tables as well, in their final shape.
+"""
+
+STATEMENTS = [
+    # ---- product search (search.py) ----
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    # Trigram GIN indexes serve ILIKE '%term%' without a sequential scan
+    "CREATE INDEX IF NOT EXISTS inventory_product_id_trgm ON inventory USING gin (product_id gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS inventory_name_trgm ON inventory USING gin (name gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS inventory_supplier_trgm ON inventory USING gin (supplier gin_trgm_ops)",
+    # B-tree prefix indexes for 1-2 character terms (too short for trigrams)
+    "CREATE INDEX IF NOT EXISTS inventory_product_id_prefix ON inventory (lower(product_id) text_pattern_ops)",
+    "CREATE INDEX IF NOT EXISTS inventory_name_prefix ON inventory (lower(name) text_pattern_ops)",
+    # ---- keyset pagination (pagination.py INVENTORY_SORTS) ----
+    "CREATE INDEX IF NOT EXISTS inventory_product_id_id ON inventory (product_id, id)",
+    "CREATE INDEX IF NOT EXISTS inventory_name_id ON inventory (name, id)",
+    "CREATE INDEX IF NOT EXISTS inventory_stock_id ON inventory (stock, id)",
+    # ---- data version counters (cache.py) ----
+    """
+    CREATE TABLE IF NOT EXISTS data_versions (
+        name       TEXT PRIMARY KEY,
+        version    BIGINT NOT NULL DEFAULT 1,
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    )
+    """,
+    "INSERT INTO data_versions (name) VALUES ('inventory') ON CONFLICT (name) DO NOTHING",
+    # bumped by every invoice write; ETags of the invoice pages (app.py versioned())
+    "INSERT INTO data_versions (name) VALUES ('invoices') ON CONFLICT (name) DO NOTHING",
+    # ---- precomputed invoice totals (maintained by save/edit routes) ----
+    "ALTER TABLE invoices ADD COLUMN IF NOT EXISTS total NUMERIC(14, 2) NOT NULL DEFAULT 0",
+    "ALTER TABLE invoices ADD COLUMN IF NOT EXISTS item_count INTEGER NOT NULL DEFAULT 0",
+    # Backfill invoices created before the columns existed (no-op once in sync)
+    """
+    UPDATE invoices AS i
+    SET total = s.total, item_count = s.item_count
+    FROM (
+        SELECT invoice_id, COALESCE(SUM(subtotal), 0) AS total, COUNT(*) AS item_count
+        FROM invoice_items
+        GROUP BY invoice_id
+    ) AS s
+    WHERE i.id = s.invoice_id
+      AND (i.total, i.item_count) IS DISTINCT FROM (s.total, s.item_count)
+    """,
+    # Keyset pagination of /invoices (newest first)
+    "CREATE INDEX IF NOT EXISTS invoices_created_at_id ON invoices (created_at, id)",
+    "CREATE INDEX IF NOT EXISTS invoice_items_invoice_id ON invoice_items (invoice_id)",
+    # ---- PDF cache (pdf_cache.py): content version bumped by every invoice edit ----
+    "ALTER TABLE invoices ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1",
+    "CREATE INDEX IF NOT EXISTS invoice_items_product_id ON invoice_items (product_id)",
+    # ---- image variants (images.py): image_url = detail size, thumb_url = list size ----
+    "ALTER TABLE inventory ADD COLUMN IF NOT EXISTS thumb_url TEXT",
+    # ---- field encryption (field_crypto.py): enc:v1:... values are longer than the names ----
+    "ALTER TABLE invoices ALTER COLUMN customer_name TYPE TEXT",
+    # ---- bulk import (bulk_import.py): upsert ON CONFLICT (product_id) ----
+    # Fails if the table already has duplicate product_ids; merge those first.
+    "CREATE UNIQUE INDEX IF NOT EXISTS inventory_product_id_key ON inventory (product_id)",
+    # ---- stock ledger (repository.py STOCK LEDGER): append-only, written with every stock change ----
+    # No foreign key: the history outlives deleted products
+    """
+    CREATE TABLE IF NOT EXISTS stock_movements (
+        id         BIGSERIAL PRIMARY KEY,
+        product_id INTEGER NOT NULL,
+        delta      INTEGER NOT NULL,
+        reason     TEXT NOT NULL,
+        invoice_id INTEGER,
+        moved_at   TIMESTAMPTZ NOT NULL DEFAULT now()
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS stock_movements_product_moved ON stock_movements (product_id, moved_at)",
+    "CREATE INDEX IF NOT EXISTS stock_movements_moved_at ON stock_movements (moved_at)",
+    """
+    CREATE TABLE IF NOT EXISTS stock_snapshots (
+        product_id INTEGER NOT NULL,
+        taken_at   TIMESTAMPTZ NOT NULL,
+        stock      INTEGER NOT NULL,
+        PRIMARY KEY (product_id, taken_at)
+    )
+    """,
+    # Opening balances: the stock at the time the ledger starts (only while it is empty)
+    """
+    INSERT INTO stock_movements (product_id, delta, reason)
+    SELECT id, stock, 'opening' FROM inventory
+    WHERE stock <> 0 AND NOT EXISTS (SELECT 1 FROM stock_movements)
+    """,
+    # ---- sales analytics (analytics.py): per-day rollups, re-aggregated for dirty days ----
+    """
+    CREATE TABLE IF NOT EXISTS sales_daily (
+        day        DATE NOT NULL,
+        product_id INTEGER NOT NULL,
+        quantity   INTEGER NOT NULL,
+        revenue    NUMERIC(14, 2) NOT NULL,
+        cost       NUMERIC(14, 2) NOT NULL,
+        PRIMARY KEY (day, product_id)
+    )
+    """,
+    # bumped with every rollup swap; part of the /analytics ETag
+    "INSERT INTO data_versions (name) VALUES ('sales') ON CONFLICT (name) DO NOTHING",
+    # Days whose invoices changed since they were rolled up (marked by every invoice write)
+    "CREATE TABLE IF NOT EXISTS sales_dirty_days (day DATE PRIMARY KEY)",
+    # Backfill: every day with invoices, while nothing has been rolled up yet
+    """
+    INSERT INTO sales_dirty_days (day)
+    SELECT DISTINCT CAST(created_at AS DATE) FROM invoices
+    WHERE NOT EXISTS (SELECT 1 FROM sales_daily)
+    ON CONFLICT (day) DO NOTHING
+    """,
+]
+
+
+# Same tables, columns and indexes for DB_BACKEND=sqlite. AUTOINCREMENT keeps ids
+# from being reused after a delete, like a Postgres sequence (the PDF cache is
+# keyed by invoice id). Timestamps are ISO text
+# ("YYYY-MM-DD HH:MM:SS.fff", so they sort correctly); NOCASE indexes serve the
+# case-insensitive prefix search that lower(...) text_pattern_ops serves in Postgres.
+SQLITE_STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS inventory (
+        id            INTEGER PRIMARY KEY AUTOINCREMENT,
+        product_id    TEXT NOT NULL,
+        name          TEXT NOT NULL,
+        stock         INTEGER NOT NULL DEFAULT 0,
+        supplier      TEXT,
+        cost_price    NUMERIC NOT NULL DEFAULT 0,
+        selling_price NUMERIC NOT NULL DEFAULT 0,
+        image_url     TEXT,
+        thumb_url     TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS invoices (
+        id            INTEGER PRIMARY KEY AUTOINCREMENT,
+        customer_name TEXT,
+        created_at    TEXT NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')),
+        total         NUMERIC NOT NULL DEFAULT 0,
+        item_count    INTEGER NOT NULL DEFAULT 0,
+        version       INTEGER NOT NULL DEFAULT 1
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS invoice_items (
+        id         INTEGER PRIMARY KEY AUTOINCREMENT,
+        invoice_id INTEGER NOT NULL REFERENCES invoices (id) ON DELETE CASCADE,
+        product_id INTEGER NOT NULL REFERENCES inventory (id),
+        quantity   INTEGER NOT NULL,
+        price      NUMERIC NOT NULL,
+        subtotal   NUMERIC NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS data_versions (
+        name       TEXT PRIMARY KEY,
+        version    INTEGER NOT NULL DEFAULT 1,
+        updated_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now'))
+    )
+    """,
+    "INSERT OR IGNORE INTO data_versions (name) VALUES ('inventory'), ('invoices'), ('sales')",
+    "CREATE INDEX IF NOT EXISTS inventory_product_id_nocase ON inventory (product_id COLLATE NOCASE)",
+    "CREATE INDEX IF NOT EXISTS inventory_name_nocase ON inventory (name COLLATE NOCASE)",
+    "CREATE INDEX IF NOT EXISTS inventory_product_id_id ON inventory (product_id, id)",
+    "CREATE INDEX IF NOT EXISTS inventory_name_id ON inventory (name, id)",
+    "CREATE INDEX IF NOT EXISTS inventory_stock_id ON inventory (stock, id)",
+    "CREATE INDEX IF NOT EXISTS invoices_created_at_id ON invoices (created_at, id)",
+    "CREATE INDEX IF NOT EXISTS invoice_items_invoice_id ON invoice_items (invoice_id)",
+    "CREATE INDEX IF NOT EXISTS invoice_items_product_id ON invoice_items (product_id)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS inventory_product_id_key ON inventory (product_id)",
+    """
+    CREATE TABLE IF NOT EXISTS stock_movements (
+        id         INTEGER PRIMARY KEY AUTOINCREMENT,
+        product_id INTEGER NOT NULL,
+        delta      INTEGER NOT NULL,
+        reason     TEXT NOT NULL,
+        invoice_id INTEGER,
+        moved_at   TEXT NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now'))
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS stock_movements_product_moved ON stock_movements (product_id, moved_at)",
+    "CREATE INDEX IF NOT EXISTS stock_movements_moved_at ON stock_movements (moved_at)",
+    """
+    CREATE TABLE IF NOT EXISTS stock_snapshots (
+        product_id INTEGER NOT NULL,
+        taken_at   TEXT NOT NULL,
+        stock      INTEGER NOT NULL,
+        PRIMARY KEY (product_id, taken_at)
+    )
+    """,
+    """
+    INSERT INTO stock_movements (product_id, delta, reason)
+    SELECT id, stock, 'opening' FROM inventory
+    WHERE stock <> 0 AND NOT EXISTS (SELECT 1 FROM stock_movements)
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS sales_daily (
+        day        TEXT NOT NULL,
+        product_id INTEGER NOT NULL,
+        quantity   INTEGER NOT NULL,
+        revenue    NUMERIC NOT NULL,
+        cost       NUMERIC NOT NULL,
+        PRIMARY KEY (day, product_id)
+    )
+    """,
+    "CREATE TABLE IF NOT EXISTS sales_dirty_days (day TEXT PRIMARY KEY)",
+    """
+    INSERT INTO sales_dirty_days (day)
+    SELECT DISTINCT date(created_at) FROM invoices
+    WHERE NOT EXISTS (SELECT 1 FROM sales_daily)
+    ON CONFLICT (day) DO NOTHING
+    """,
+]
+
+
+def apply_schema(conn):
+    with conn.cursor() as cur:
+        for stmt in STATEMENTS:
+            cur.execute(stmt)
+    conn.commit()
+    return len(STATEMENTS)
+
+
+def apply_sqlite_schema(conn):
+    """SQLITE_STATEMENTS in one transaction (conn in autocommit mode, isolation_level=None)."""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for stmt in SQLITE_STATEMENTS:
+            conn.execute(stmt)
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return len(SQLITE_STATEMENTS)
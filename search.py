@@ -0,0 +1,196 @@
+import os
+import threading
+
+from cache import TTLCache, catalog_cache
+from pagination import Page, keyset_page
+
+SEARCH_LIMIT = int(os.getenv("SEARCH_LIMIT", "50"))
+MIN_TRIGRAM_LEN = 3  # pg_trgm cannot use the index for shorter terms
+
+# Lower rank = better match. product_id prefix hits always come first.
+RANK_SQL = """
+    CASE
+        WHEN lower(product_id) LIKE %(prefix)s THEN 0
+        WHEN lower(name) LIKE %(prefix)s THEN 1
+        WHEN product_id ILIKE %(like)s THEN 2
+        WHEN name ILIKE %(like)s THEN 3
+        ELSE 4
+    END
+"""
+
+
+# SQLite has no ILIKE, but its LIKE is case-insensitive (ASCII) already and can
+# use the COLLATE NOCASE indexes for prefixes. No default escape character there.
+SQLITE_RANK_SQL = """
+    CASE
+        WHEN product_id LIKE %(prefix)s ESCAPE '\\' THEN 0
+        WHEN name LIKE %(prefix)s ESCAPE '\\' THEN 1
+        WHEN product_id LIKE %(like)s ESCAPE '\\' THEN 2
+        WHEN name LIKE %(like)s ESCAPE '\\' THEN 3
+        ELSE 4
+    END
+"""
+
+
+def escape_like(term):
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def search_params(term):
+    escaped = escape_like(term.strip())
+    return {
+        "term": term,
+        "prefix": escaped.lower() + "%",
+        "like": f"%{escaped}%",
+    }
+
+
+def search_filter_sql(term, dialect="postgres"):
+    """WHERE clause matching `term`; params come from search_params()."""
+    if dialect == "sqlite":
+        if len(term.strip()) < MIN_TRIGRAM_LEN:
+            return "(product_id LIKE %(prefix)s ESCAPE '\\' OR name LIKE %(prefix)s ESCAPE '\\')"
+        return ("(product_id LIKE %(like)s ESCAPE '\\' OR name LIKE %(like)s ESCAPE '\\'"
+                " OR supplier LIKE %(like)s ESCAPE '\\')")
+    if len(term.strip()) < MIN_TRIGRAM_LEN:
+        # Short terms: prefix only, served by the lower(...) text_pattern_ops indexes
+        return "(lower(product_id) LIKE %(prefix)s OR lower(name) LIKE %(prefix)s)"
+    return "(product_id ILIKE %(like)s OR name ILIKE %(like)s OR supplier ILIKE %(like)s)"
+
+
+def search_products(cursor, term, limit=SEARCH_LIMIT, columns="*", after=None, before=None,
+                    dialect="postgres"):
+    """Ranked product search over product_id / name / supplier.
+
+    Backed by the pg_trgm indexes from schema.py, so latency depends on the
+    number of matches (capped by `limit`) rather than on catalog size.
+    Returns a pagination.Page; follow its cursors for further results.
+    """
+    rank = SQLITE_RANK_SQL if dialect == "sqlite" else RANK_SQL
+    order = [rank.strip(), "product_id", "id"]
+    return keyset_page(cursor, columns, "inventory", order,
+                       where=search_filter_sql(term, dialect), params=search_params(term),
+                       after=after, before=before, limit=limit)
+
+
+# -------------------- RESULT CACHE --------------------
+# Live search fires one request per keystroke, and many cashiers type the same
+# prefixes. First pages are cached for a few seconds per normalised term,
+# identical concurrent searches share one query (single-flight), and a term
+# that extends a cached term whose matches all fit on one page is answered by
+# filtering that page in memory.
+
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "10"))
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "2000"))
+
+
+def normalize_term(term):
+    # ILIKE and the lower(...) prefix match are case-insensitive already
+    return term.strip().lower()
+
+
+def match_rank(row, term):
+    """Python twin of search_filter_sql() + RANK_SQL for a normalised term; None = no match."""
+    product_id = (row.get("product_id") or "").lower()
+    name = (row.get("name") or "").lower()
+    if product_id.startswith(term):
+        return 0
+    if name.startswith(term):
+        return 1
+    if len(term) < MIN_TRIGRAM_LEN:
+        return None
+    if term in product_id:
+        return 2
+    if term in name:
+        return 3
+    if term in (row.get("supplier") or "").lower():
+        return 4
+    return None
+
+
+class _Flight:
+    def __init__(self):
+        self.event = threading.Event()
+        self.page = None
+
+
+class SearchCache:
+    def __init__(self, maxsize=2000, ttl=10.0, wait_timeout=5.0):
+        self.pages = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.wait_timeout = wait_timeout
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.narrowed = 0
+        self.coalesced = 0
+        self.queries = 0
+
+    def search(self, db, term, limit=SEARCH_LIMIT, columns="*"):
+        """First result page for `term` (a pagination.Page shared between callers); `db` is a repository session."""
+        catalog_cache.sync(db)
+        version = catalog_cache.version
+        term = normalize_term(term)
+        key = (version, columns, limit, term)
+
+        page = self.pages.get(key)
+        if page is not None:
+            self.hits += 1
+            return page
+        page = self._narrow(version, columns, limit, term)
+        if page is not None:
+            self.narrowed += 1
+            self.pages.set(key, page)
+            return page
+
+        with self._lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+        if not leader:
+            if flight.event.wait(self.wait_timeout) and flight.page is not None:
+                self.coalesced += 1
+                return flight.page
+            return self._load(db, term, limit, columns)  # leader failed or is stuck
+        try:
+            page = flight.page = self._load(db, term, limit, columns)
+            if version == catalog_cache.version:
+                self.pages.set(key, page)
+            return page
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.event.set()
+
+    def _load(self, db, term, limit, columns):
+        self.queries += 1
+        # supplier is needed to narrow this page for longer terms later on
+        if columns != "*" and "supplier" not in columns:
+            columns += ", supplier"
+        return db.search_products(term, limit=limit, columns=columns)
+
+    def _narrow(self, version, columns, limit, term):
+        for i in range(len(term) - 1, 0, -1):
+            prefix = term[:i]
+            if len(prefix) < MIN_TRIGRAM_LEN <= len(term):
+                break  # prefix match on the short term is not a superset of a substring match
+            base = self.pages.get((version, columns, limit, prefix))
+            if base is None or base.next_cursor is not None:
+                continue  # not cached, or only the first page of a longer result
+            ranked = []
+            for row in base.rows:
+                rank = match_rank(row, term)
+                if rank is not None:
+                    ranked.append((rank, row.get("product_id") or "", row["id"], row))
+            if len(ranked) > limit:
+                return None
+            ranked.sort(key=lambda r: r[:3])
+            return Page([r[3] for r in ranked])
+        return None
+
+    def stats(self):
+        return {"hits": self.hits, "narrowed": self.narrowed, "coalesced": self.coalesced,
+                "queries": self.queries, "ttl_s": self.pages.ttl, "size": self.pages.stats()["size"]}
+
+
+search_cache = SearchCache(maxsize=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL)
@@ -0,0 +1,73 @@
+"""Compact JSON for the live-search (XHR) responses.
+
+Rows are converted column by column (one converter per column instead of a
+type check per cell) and encoded with orjson when it is installed. The
+encoded body is memoised on the Page, which the catalog cache shares between
+requests until the next inventory write.
+"""
+import json
+from decimal import Decimal
+
+try:
+    import orjson
+except ImportError:  # optional speed-up
+    orjson = None
+
+from pagination import PICKER_COLUMNS
+
+PICKER_FIELDS = tuple(c.strip() for c in PICKER_COLUMNS.split(","))
+
+# column -> converter for values the JSON encoder can't take as they are
+COLUMN_TYPES = {
+    "id": int,
+    "stock": int,
+    "cost_price": float,
+    "selling_price": float,
+}
+
+LAYOUTS = ("objects", "columns")
+
+
+def dumps(value):
+    """JSON bytes; orjson if available, else the stdlib encoder."""
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, separators=(",", ":"), default=_default).encode()
+
+
+def _default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    raise TypeError(f"Cannot encode {type(value).__name__}")
+
+
+def to_columns(rows, fields):
+    """[[values of field 0], [values of field 1], ...] with COLUMN_TYPES applied."""
+    columns = []
+    for name in fields:
+        values = [row[name] for row in rows]
+        conv = COLUMN_TYPES.get(name)
+        if conv is not None:
+            values = [None if v is None else conv(v) for v in values]
+        columns.append(values)
+    return columns
+
+
+def encode_rows(rows, fields=PICKER_FIELDS, layout="objects"):
+    """`objects`: [{field: value}, ...]; `columns`: {"fields": [...], "columns": [[...], ...]}."""
+    columns = to_columns(rows, fields)
+    if layout == "columns":
+        return dumps({"fields": list(fields), "columns": columns})
+    return dumps([dict(zip(fields, values)) for values in zip(*columns)])
+
+
+def encode_page(page, fields=PICKER_FIELDS, layout="objects"):
+    """encode_rows() for a (possibly cached and shared) Page, computed once per layout."""
+    cache = page.__dict__.setdefault("_encoded", {})
+    key = (fields, layout)
+    body = cache.get(key)
+    if body is None:
+        body = cache[key] = encode_rows(page.rows, fields, layout)
+    return body